@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Time _exxo_elf.readelf() on shared libraries.
+
+    python bench/readelf.py [--baseline REV] [--check] PATH...
+
+PATH is a shared library or a directory searched for them (an unpacked
+wheel, site-packages). Best of --repeat runs over all files is reported.
+--baseline times _exxo_elf.py of a git revision as well, e.g. c95e88e^
+for the section based parser. --check compares the strings with
+binutils readelf -d. Runs with python 2.7 and 3.
+"""
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+import types
+import argparse
+import subprocess
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(base_dir, 'exxo', 'frozen'))
+
+import _exxo_elf
+
+DYNAMIC_RE = re.compile(r'\((NEEDED|SONAME|RPATH|RUNPATH)\)\s+.*?\[(.*)\]$')
+
+
+def find_libraries(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for fn in sorted(filenames):
+                if fn.endswith('.so') or '.so.' in fn:
+                    full = os.path.join(dirpath, fn)
+                    if not os.path.islink(full):
+                        yield full
+
+
+def load_revision(rev):
+    src = subprocess.check_output(['git', 'show', rev + ':exxo/frozen/_exxo_elf.py'],
+                                  cwd=base_dir)
+    mod = types.ModuleType('_exxo_elf_' + rev)
+    exec(compile(src, '{0}:_exxo_elf.py'.format(rev), 'exec'), mod.__dict__)
+    return mod
+
+
+def best_time(func, files, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for path in files:
+            func(path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def dynamic_strings(path):
+    # {tag name: [string, ...]} from our parser
+    names = {_exxo_elf.DT_NEEDED: 'NEEDED', _exxo_elf.DT_SONAME: 'SONAME',
+             _exxo_elf.DT_RPATH: 'RPATH', _exxo_elf.DT_RUNPATH: 'RUNPATH'}
+    result = {}
+    for tag, values in _exxo_elf.readelf(path)['dynamic'].items():
+        result[names[tag]] = [v.decode('utf-8') for v in values]
+    return result
+
+
+def binutils_strings(path):
+    out = subprocess.check_output(['readelf', '-d', path]).decode('utf-8')
+    result = {}
+    for line in out.splitlines():
+        m = DYNAMIC_RE.search(line.strip())
+        if m is not None:
+            result.setdefault(m.group(1), []).append(m.group(2))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time _exxo_elf.readelf()')
+    parser.add_argument('paths', nargs='+', metavar='PATH')
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    parser.add_argument('--baseline', metavar='REV',
+                        help='git revision of _exxo_elf.py to compare with')
+    parser.add_argument('--check', action='store_true',
+                        help='compare results with binutils readelf -d')
+    args = parser.parse_args()
+    files = list(find_libraries(args.paths))
+    if not files:
+        sys.exit('no shared libraries found')
+    print('python {0}, {1} files'.format(sys.version.split()[0], len(files)))
+    current = best_time(_exxo_elf.readelf, files, args.repeat)
+    if args.baseline:
+        # python 2 clears globals of a module once it's gone: keep it
+        old_elf = load_revision(args.baseline)
+        baseline = best_time(old_elf.readelf, files, args.repeat)
+        print('{0}: {1:.1f} ms'.format(args.baseline, baseline * 1000))
+    print('current: {0:.1f} ms'.format(current * 1000))
+    if args.baseline:
+        print('speedup: {0:.1f}x'.format(baseline / current))
+    if args.check:
+        bad = [path for path in files if dynamic_strings(path) != binutils_strings(path)]
+        for path in bad:
+            print('mismatch: {0}'.format(path))
+        if bad:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,699 @@
+import os
+import sys
+import stat
+import json
+import time
+import zlib
+import fcntl
+import shutil
+import struct
+import hashlib
+import zipfile
+import zipapp
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from .frozen._exxo_index import (INDEX_NAME, SOLIBS_NAME, PREFETCH_NAME, SNAPSHOT_NAME,
+                                 CHECKPOINTS_NAME, FLAG_DIR, FLAG_DEFLATED, FLAG_NATIVE,
+                                 build_index, dump_solibs, dump_checkpoints)
+from .solibs import ORIGIN, SolibResolver, read_solib, is_extension
+
+
+MANIFEST_VERSION = 6
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+LOCAL_MAGIC = b'PK\003\004'
+CENTRAL_MAGIC = b'PK\001\002'
+END_MAGIC = b'PK\005\006'
+# we never write zip64 records: patched zipimport is unable to read them
+ZIP_LIMIT = (1 << 32) - 1
+ZIP_MAX_ENTRIES = (1 << 16) - 1
+ZIP_VERSION = 20
+UTF8_FLAG = 0x800
+DIR_MODE = stat.S_IFDIR | 0o755
+# stored native members are page aligned, so that the runtime can copy
+# them out of the executable with copy_file_range/sendfile. the
+# padding goes to an extra field of the local header (same id as
+# android's zipalign uses)
+PAGE_SIZE = 4096
+ALIGN_EXTRA_ID = 0xD935
+ALIGN_EXTRA = struct.Struct('<HHH')
+ELF_MAGIC = b'\x7fELF'
+# timestamp of deterministic builds, unless SOURCE_DATE_EPOCH is set:
+# the earliest date zip format can express
+ZIP_EPOCH = 315532800
+
+HASH_BUFSIZE = 1 << 20
+# linux ioctl sharing extents of a file on btrfs, xfs, etc.
+FICLONE = 0x40049409
+COPY_CHUNK = 1 << 30
+# deflated members bigger than that get a restart point every
+# CHECKPOINT_INTERVAL bytes, so that the runtime can seek in them
+CHECKPOINT_INTERVAL = 1 << 20
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(str(path), 'rb') as fp:
+        while True:
+            buf = fp.read(HASH_BUFSIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def deflate(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return c.compress(data) + c.flush()
+
+
+def deflate_checkpoints(data, level, interval=CHECKPOINT_INTERVAL):
+    # the compressor is fully flushed every interval bytes: inflating
+    # can start over from any of these points. returns compressed data
+    # and (offset, compressed offset) of the points
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    chunks = []
+    points = []
+    size = 0
+    for pos in range(0, len(data), interval):
+        if pos:
+            points.append((pos, size))
+        chunk = c.compress(data[pos:pos + interval])
+        chunk += c.flush(zlib.Z_FULL_FLUSH if pos + interval < len(data) else zlib.Z_FINISH)
+        chunks.append(chunk)
+        size += len(chunk)
+    return b''.join(chunks), points
+
+
+def compress_file(path, level, epoch=None, rpath_offset=None):
+    # runs in worker processes: read the file there, so that only
+    # compressed bytes travel back to the parent
+    with open(str(path), 'rb') as fp:
+        data = fp.read()
+    if rpath_offset is not None:
+        end = rpath_offset + len(ORIGIN) + 1
+        data = data[:rpath_offset] + ORIGIN + b'\0' + data[end:]
+    if epoch is not None and str(path).endswith(('.pyc', '.pyo')) and len(data) >= 8:
+        # bytecode header carries source mtime (python 2.7 - 3.6 layout),
+        # zipimport compares it with the zip timestamp of the source
+        data = data[:4] + struct.pack('<I', dos_mtime(epoch) & 0xFFFFFFFF) + data[8:]
+    crc = zlib.crc32(data) & 0xFFFFFFFF
+    checkpoints = None
+    if level and len(data) > CHECKPOINT_INTERVAL:
+        data, checkpoints = deflate_checkpoints(data, level, CHECKPOINT_INTERVAL)
+    elif level:
+        data = deflate(data, level)
+    return crc, data, checkpoints
+
+
+# formats that don't get any smaller when deflated again
+MEDIA_SUFFIXES = frozenset((
+    '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.zst', '.zip', '.whl', '.egg', '.jar',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.woff', '.woff2', '.mp3', '.ogg', '.mp4', '.webm',
+))
+BYTECODE_SUFFIXES = frozenset(('.pyc', '.pyo'))
+
+
+def is_native(name, path, mode):
+    # shared libraries and bundled executables
+    fn = name.rsplit('/', 1)[-1]
+    if fn.endswith('.so') or '.so.' in fn:
+        return True
+    if not mode & 0o111:
+        return False
+    with open(str(path), 'rb') as fp:
+        return fp.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+
+class CompressionPolicy:
+    # compression level for every file class; 0 means ZIP_STORED
+    DEFAULTS = {
+        'pyc': 6,
+        'data': 6,
+        'media': 0,
+        'native': 0,
+        'default': 6,
+    }
+    SMALL_PYC_SIZE = 64 * 1024
+    LARGE_DATA_SIZE = 1024 * 1024
+
+    def __init__(self, **levels):
+        self.levels = dict(self.DEFAULTS)
+        for cls, level in levels.items():
+            if cls not in self.DEFAULTS:
+                raise ValueError('unknown file class: {}'.format(cls))
+            if not 0 <= level <= 9:
+                raise ValueError('invalid compression level for {}: {}'.format(cls, level))
+            self.levels[cls] = level
+
+    @classmethod
+    def parse(cls, spec):
+        # "pyc=stored,data=9"
+        levels = {}
+        for item in filter(None, spec.split(',')):
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise ValueError('expected class=level, got: {}'.format(item))
+            value = value.strip()
+            if value == 'stored':
+                levels[name.strip()] = 0
+            elif value.isdigit():
+                levels[name.strip()] = int(value)
+            else:
+                raise ValueError('invalid compression level: {}'.format(value))
+        return cls(**levels)
+
+    def classify(self, name, size, native=False):
+        if native:
+            return 'native'
+        suffix = os.path.splitext(name)[1].lower()
+        if suffix in BYTECODE_SUFFIXES and size <= self.SMALL_PYC_SIZE:
+            return 'pyc'
+        if suffix in MEDIA_SUFFIXES:
+            return 'media'
+        if size >= self.LARGE_DATA_SIZE:
+            return 'data'
+        return 'default'
+
+    def level(self, name, size, native=False):
+        return self.levels[self.classify(name, size, native)]
+
+
+# busybox style __main__.py for projects with several console scripts
+MULTICALL_TEMPLATE = """\
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+SCRIPTS = dict({scripts!r})
+DEFAULT = {default!r}
+
+
+def _exxo_select():
+    # the name the binary was invoked as (symlink or hardlink) picks the
+    # script. otherwise the first argument is a subcommand. the binary
+    # itself is usually named after the default script
+    for path in (sys.argv[0] if sys.argv else None, sys.executable):
+        name = os.path.basename(path or '')
+        if name in SCRIPTS and name != DEFAULT:
+            return name
+    if len(sys.argv) > 1 and sys.argv[1] in SCRIPTS:
+        name = sys.argv.pop(1)
+        sys.argv[0] = name
+        return name
+    return DEFAULT
+
+
+def _exxo_run(name):
+    module, attrs = SCRIPTS[name]
+    obj = __import__(module, fromlist=['__name__'])
+    for attr in attrs.split('.'):
+        obj = getattr(obj, attr)
+    sys.exit(obj())
+
+
+_exxo_name = _exxo_select()
+if _exxo_name is None:
+    sys.stderr.write('usage: {{0}} COMMAND [ARGS]...\\n\\ncommands:\\n'.format(
+        os.path.basename(sys.argv[0] if sys.argv and sys.argv[0] else sys.executable)))
+    for _exxo_name in sorted(SCRIPTS):
+        sys.stderr.write('  {{0}}\\n'.format(_exxo_name))
+    sys.exit(2)
+_exxo_run(_exxo_name)
+"""
+
+
+def parse_entry_point(spec):
+    # "package.module:function [extra]" -> (module, function)
+    mod, sep, fn = spec.split('[', 1)[0].partition(':')
+    mod, fn = mod.strip(), fn.strip()
+    if not (sep and mod and fn):
+        sys.exit('invalid main function: {} (expected package.module:function)'
+                 .format(spec))
+    return mod, fn
+
+
+def dos_date_time(mtime):
+    # local time, zipimport decodes it with mktime()
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 1 << 5 | 1, 0
+    date = (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dtime = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return date, dtime
+
+
+def dos_mtime(mtime):
+    # mtime as zipimport sees it after a round trip through dos_date_time
+    date, dtime = dos_date_time(mtime)
+    return int(time.mktime((1980 + (date >> 9), date >> 5 & 0xF, date & 0x1F,
+                            dtime >> 11, dtime >> 5 & 0x3F, (dtime & 0x1F) * 2, 0, 0, -1)))
+
+
+class Member:
+    __slots__ = ('name', 'size', 'mtime', 'mode', 'digest', 'crc', 'level',
+                 'compress_size', 'offset', 'native', 'rpath_offset', 'checkpoints')
+
+    def __init__(self, name, size=0, mtime=0, mode=0, digest=None, crc=0,
+                 level=0, compress_size=0, offset=None, native=False,
+                 rpath_offset=None, checkpoints=None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.digest = digest
+        self.crc = crc
+        self.level = level
+        self.compress_size = compress_size
+        # offset of member data (not the local header) in the archive
+        self.offset = offset
+        self.native = native
+        # offset of RPATH string replaced with $ORIGIN in stored data
+        # (digest is still of the original file)
+        self.rpath_offset = rpath_offset
+        # (offset, compressed offset) restart points of deflated data
+        self.checkpoints = checkpoints
+
+    @property
+    def is_dir(self):
+        return self.name.endswith('/')
+
+    @property
+    def method(self):
+        return zipfile.ZIP_DEFLATED if self.level else zipfile.ZIP_STORED
+
+    def to_json(self):
+        return {k: getattr(self, k) for k in self.__slots__ if k != 'name'}
+
+    @classmethod
+    def from_json(cls, name, d):
+        return cls(name, **d)
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.archive = None
+        self.options = None
+        self.members = {}
+
+    def load(self):
+        try:
+            with self.path.open() as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.archive = data['archive']
+        self.options = data['options']
+        self.members = {name: Member.from_json(name, d)
+                        for name, d in data['members'].items()}
+
+    def save(self, archive, members, options=None):
+        data = {
+            'version': MANIFEST_VERSION,
+            'archive': archive,
+            'options': options or {},
+            'members': {m.name: m.to_json() for m in members},
+        }
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as fp:
+            json.dump(data, fp, sort_keys=True)
+        tmp.rename(self.path)
+
+
+def archive_stamp(path):
+    st = os.stat(str(path))
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def normalized_mode(member):
+    if member.is_dir:
+        return DIR_MODE
+    return stat.S_IFREG | (0o755 if member.mode & 0o111 else 0o644)
+
+
+class ZipWriter:
+    def __init__(self, fp, epoch=None):
+        # with epoch set, every member gets the same timestamp and
+        # normalized permissions, so that output depends on content only
+        self.fp = fp
+        self.epoch = epoch
+        self.members = []
+
+    def _date_time(self, member):
+        if self.epoch is not None:
+            return dos_date_time(self.epoch)
+        return dos_date_time(member.mtime)
+
+    def _mode(self, member):
+        return member.mode if self.epoch is None else normalized_mode(member)
+
+    def write_index(self, hot=(0, 0)):
+        # lookup table for the runtime, so that it doesn't have to parse
+        # the central directory. has to be the last member. hot is
+        # (offset, size) of members read at startup
+        entries = []
+        build_id = hashlib.sha256()
+        for member, _ in self.members:
+            flags = ((FLAG_DIR if member.is_dir else 0) |
+                     (FLAG_DEFLATED if member.method == zipfile.ZIP_DEFLATED else 0) |
+                     (FLAG_NATIVE if member.native else 0))
+            mtime = int(member.mtime if self.epoch is None else self.epoch)
+            entries.append((member.name, flags, member.offset, member.compress_size,
+                            member.size, member.crc, self._mode(member), mtime))
+            build_id.update('{}\0{}\0{}\0'.format(member.name, member.crc, member.size)
+                            .encode('utf-8'))
+        data = build_index(entries, build_id.digest()[:16], hot)
+        mtime = time.time() if self.epoch is None else self.epoch
+        member = Member(INDEX_NAME, size=len(data), mtime=mtime,
+                        mode=stat.S_IFREG | 0o644, crc=zlib.crc32(data) & 0xFFFFFFFF,
+                        compress_size=len(data))
+        self.write(member, data)
+
+    def _align_extra(self, data_offset):
+        pad = -(data_offset + ALIGN_EXTRA.size) % PAGE_SIZE
+        return ALIGN_EXTRA.pack(ALIGN_EXTRA_ID, 2 + pad, PAGE_SIZE) + b'\0' * pad
+
+    def write(self, member, data):
+        name = member.name.encode('utf-8')
+        date, dtime = self._date_time(member)
+        header_offset = self.fp.tell()
+        if header_offset > ZIP_LIMIT or member.compress_size > ZIP_LIMIT:
+            raise zipfile.LargeZipFile('archive too large (zip64 is not supported)')
+        extra = b''
+        if member.native and member.method == zipfile.ZIP_STORED:
+            extra = self._align_extra(header_offset + LOCAL_HEADER.size + len(name))
+        self.fp.write(LOCAL_HEADER.pack(
+            LOCAL_MAGIC, ZIP_VERSION, UTF8_FLAG, member.method, dtime, date,
+            member.crc, member.compress_size, member.size, len(name), len(extra)))
+        self.fp.write(name)
+        self.fp.write(extra)
+        member.offset = self.fp.tell()
+        self.fp.write(data)
+        self.members.append((member, header_offset))
+
+    def close(self):
+        if len(self.members) > ZIP_MAX_ENTRIES:
+            raise zipfile.LargeZipFile('too many files in archive (zip64 is not supported)')
+        start = self.fp.tell()
+        for member, header_offset in self.members:
+            name = member.name.encode('utf-8')
+            date, dtime = self._date_time(member)
+            external_attr = (self._mode(member) & 0xFFFF) << 16
+            if member.is_dir:
+                external_attr |= 0x10
+            self.fp.write(CENTRAL_HEADER.pack(
+                CENTRAL_MAGIC, ZIP_VERSION, ZIP_VERSION, UTF8_FLAG, member.method,
+                dtime, date, member.crc, member.compress_size, member.size,
+                len(name), 0, 0, 0, 0, external_attr, header_offset))
+            self.fp.write(name)
+        size = self.fp.tell() - start
+        count = len(self.members)
+        self.fp.write(END_RECORD.pack(END_MAGIC, 0, 0, count, count, size, start, 0))
+
+
+def clone_file(src_fd, dst_fd):
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def copy_range(src_fd, dst_fd, size):
+    # returns number of bytes copied in kernel, which may be less than
+    # size if copy_file_range is unsupported
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    copied = 0
+    if copy_file_range is None:
+        return copied
+    while copied < size:
+        try:
+            n = copy_file_range(src_fd, dst_fd, min(size - copied, COPY_CHUNK),
+                                copied, copied)
+        except OSError:
+            break
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def write_prefix(fp, path):
+    # put the file at the start of fp without pulling it through
+    # userspace, if the filesystem allows it. fp is left positioned at
+    # the next page boundary after the prefix
+    fp.flush()
+    with open(str(path), 'rb') as src_fp:
+        size = os.fstat(src_fp.fileno()).st_size
+        if clone_file(src_fp.fileno(), fp.fileno()):
+            copied = size
+        else:
+            copied = copy_range(src_fp.fileno(), fp.fileno(), size)
+        fp.seek(copied)
+        if copied < size:
+            src_fp.seek(copied)
+            shutil.copyfileobj(src_fp, fp)
+    fp.write(b'\0' * (-fp.tell() % PAGE_SIZE))
+
+
+def scan_tree(source):
+    # directories are stored as explicit entries: _exxo_hack relies on
+    # them to tell bundled directories apart from files
+    result = []
+    for dirpath, dirnames, filenames in os.walk(str(source)):
+        dirnames.sort()
+        reldir = os.path.relpath(dirpath, str(source))
+        prefix = '' if reldir == '.' else reldir.replace(os.sep, '/') + '/'
+        if prefix:
+            result.append((prefix, Path(dirpath)))
+        for fn in sorted(filenames):
+            result.append((prefix + fn, Path(dirpath) / fn))
+    return result
+
+
+class ArchiveBuilder:
+    def __init__(self, source, main=None, manifest=None, incremental=True,
+                 policy=None, jobs=None, filters=(), default=None, epoch=None,
+                 index=False, prefetch=(), layout=(), snapshot=None):
+        self.source = Path(source)
+        # either a single entry point or a dict of console scripts for a
+        # multi-call binary
+        self.main = main
+        self.default = default
+        self.manifest = Manifest(manifest) if manifest else None
+        self.incremental = incremental
+        self.policy = policy or CompressionPolicy()
+        self.jobs = jobs or os.cpu_count() or 1
+        # callables narrowing down the list of (arcname, path) entries
+        # that go into the archive
+        self.filters = list(filters)
+        # timestamp of a deterministic build
+        self.epoch = epoch
+        self.index = index
+        # modules whose extensions are extracted in background at startup
+        self.prefetch = list(prefetch)
+        # member names in order of first use during a traced run
+        self.layout = list(layout)
+        # SnapshotBuilder of modules imported at startup
+        self.snapshot = snapshot
+        self.stats = {'reused': 0, 'compressed': 0}
+
+    def main_py(self):
+        main = self.main
+        if isinstance(main, dict):
+            if len(main) > 1:
+                # a sorted list of pairs: dict repr order isn't stable before 3.6
+                scripts = [(name, parse_entry_point(main[name])) for name in sorted(main)]
+                return MULTICALL_TEMPLATE.format(scripts=scripts, default=self.default)\
+                                         .encode('utf-8')
+            main, = main.values()
+        mod, fn = parse_entry_point(main)
+        return zipapp.MAIN_TEMPLATE.format(module=mod, fn=fn).encode('utf-8')
+
+    def _previous_members(self, target):
+        if self.manifest is None or not self.incremental:
+            return {}, {}
+        self.manifest.load()
+        if not target.exists() or self.manifest.archive != archive_stamp(target):
+            return {}, {}
+        if self.manifest.options != self._options():
+            # compressed bytes of bytecode depend on epoch
+            return {}, {}
+        by_digest = {}
+        for m in self.manifest.members.values():
+            if m.digest is not None:
+                by_digest.setdefault((m.digest, m.level, m.rpath_offset), m)
+        return self.manifest.members, by_digest
+
+    def _options(self):
+        return {'epoch': self.epoch}
+
+    def _stat_member(self, name, path, previous):
+        st = path.stat()
+        member = Member(name, mtime=st.st_mtime, mode=st.st_mode)
+        if member.is_dir:
+            member.mode = DIR_MODE
+            return member
+        member.size = st.st_size
+        prev = previous.get(name)
+        if prev is not None and prev.size == st.st_size and prev.mtime == st.st_mtime:
+            member.digest = prev.digest
+            member.native = prev.native
+        else:
+            member.digest = file_digest(path)
+            member.native = is_native(name, path, st.st_mode)
+        member.level = self.policy.level(name, member.size, member.native)
+        return member
+
+    def _analyze_solibs(self, members):
+        # dependencies of extension modules are resolved here once, so
+        # that the runtime doesn't have to parse ELF files
+        solibs = {}
+        for member, path in members:
+            if member.native and not member.is_dir:
+                solib = read_solib(path)
+                if solib is not None:
+                    solibs[member.name] = solib
+        if not solibs:
+            return None
+        resolver = SolibResolver(solibs)
+        deps = resolver.resolve()
+        for member, _ in members:
+            if member.name in resolver.rewrite:
+                member.rpath_offset = solibs[member.name].rpath_offset
+        return deps
+
+    def _prefetch_list(self, members):
+        extensions = sorted(m.name for m, _ in members if m.native and is_extension(m.name))
+        result = []
+        for module in self.prefetch:
+            prefix = module.replace('.', '/') + '.'
+            for name in extensions:
+                if name.startswith(prefix) and '/' not in name[len(prefix):] \
+                        and name not in result:
+                    result.append(name)
+        return result
+
+    def _compress(self, jobs):
+        # results are yielded in submission order, so the archive layout
+        # doesn't depend on which worker finishes first
+        if self.jobs <= 1 or len(jobs) <= 1:
+            for args in jobs:
+                yield compress_file(*args)
+            return
+        executor = ProcessPoolExecutor(self.jobs)
+        chunksize = max(1, min(64, len(jobs) // (self.jobs * 4)))
+        try:
+            yield from executor.map(compress_file, *zip(*jobs), chunksize=chunksize)
+        finally:
+            executor.shutdown()
+
+    @staticmethod
+    def _generated(name, data):
+        return Member(name, size=len(data), mtime=time.time(), mode=stat.S_IFREG | 0o644,
+                      crc=zlib.crc32(data) & 0xFFFFFFFF, compress_size=len(data))
+
+    def _apply_layout(self, items, layout):
+        # members recorded by EXXO_TRACE_IMPORTS go first, in order of
+        # first use. returns reordered items and number of hot ones
+        rank = {}
+        for name in layout:
+            rank.setdefault(name, len(rank))
+        hot = sorted((item for item in items if item[0].name in rank),
+                     key=lambda item: rank[item[0].name])
+        return hot + [item for item in items if item[0].name not in rank], len(hot)
+
+    def build(self, target, prefix=None):
+        # the archive is written straight after the prefix (pyrun
+        # binary), so member offsets are absolute offsets in target
+        target = Path(target)
+        previous, by_digest = self._previous_members(target)
+        plan = []
+        jobs = []
+        entries = scan_tree(self.source)
+        for f in self.filters:
+            entries = f(entries)
+        members = [(self._stat_member(name, path, previous), path) for name, path in entries
+                   if not (self.main and name == '__main__.py')]
+        solibs = self._analyze_solibs(members)
+        prefetch = self._prefetch_list(members)
+        generated = []
+        layout = self.layout
+        snapshot = self.snapshot.build(members) if self.snapshot is not None else None
+        if snapshot is not None:
+            generated.append((SNAPSHOT_NAME, snapshot))
+            if layout:
+                # read at startup, before anything else
+                layout = [SNAPSHOT_NAME] + layout
+        if solibs is not None:
+            generated.append((SOLIBS_NAME, dump_solibs(solibs)))
+        if prefetch:
+            generated.append((PREFETCH_NAME, ''.join(n + '\n' for n in prefetch).encode('utf-8')))
+        if self.main:
+            generated.append(('__main__.py', self.main_py()))
+        # (member, source path, data of generated members)
+        items = [(member, path, None) for member, path in members]
+        items.extend((self._generated(name, data), None, data) for name, data in generated)
+        items, hot_count = self._apply_layout(items, layout)
+        for member, path, data in items:
+            prev = None
+            if data is None and not member.is_dir:
+                prev = by_digest.get((member.digest, member.level, member.rpath_offset))
+                if prev is None:
+                    jobs.append((path, member.level, self.epoch, member.rpath_offset))
+            plan.append((member, prev, data))
+        tmp = target.with_name(target.name + '.tmp')
+        old_fp = target.open('rb') if by_digest else None
+        compressed = self._compress(jobs)
+        hot = (0, 0)
+        checkpoints = {}
+        try:
+            with tmp.open('wb') as fp:
+                if prefix is not None:
+                    write_prefix(fp, prefix)
+                writer = ZipWriter(fp, epoch=self.epoch)
+                for i, (member, prev, data) in enumerate(plan):
+                    if data is not None:
+                        # generated by us
+                        pass
+                    elif member.is_dir:
+                        data = b''
+                    elif prev is not None:
+                        # unchanged content: copy already compressed bytes
+                        old_fp.seek(prev.offset)
+                        data = old_fp.read(prev.compress_size)
+                        member.crc = prev.crc
+                        member.checkpoints = prev.checkpoints
+                        self.stats['reused'] += 1
+                    else:
+                        member.crc, data, member.checkpoints = next(compressed)
+                        self.stats['compressed'] += 1
+                    member.compress_size = len(data)
+                    writer.write(member, data)
+                    if member.checkpoints:
+                        checkpoints[member.name] = member.checkpoints
+                    if i == hot_count - 1:
+                        start = writer.members[0][1]
+                        hot = (start, fp.tell() - start)
+                if checkpoints and self.index:
+                    # known only once everything is compressed
+                    data = dump_checkpoints(checkpoints)
+                    writer.write(self._generated(CHECKPOINTS_NAME, data), data)
+                if self.index:
+                    writer.write_index(hot)
+                writer.close()
+        finally:
+            compressed.close()
+            if old_fp is not None:
+                old_fp.close()
+        tmp.rename(target)
+        if self.manifest is not None:
+            self.manifest.save(archive_stamp(target), [m for m, _ in writer.members],
+                               self._options())
+        return target
@@ -62,6 +62,11 @@ def ensure_dir_exists(d):
     d.mkdir(parents=True, exist_ok=True)
 
 
+def user_cache_dir(*parts):
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return Path(base, 'exxo', *parts)
+
+
 def download_url(url, dst_file):
     with urlopen(url) as src, dst_file.open('wb') as dst:
         shutil.copyfileobj(src, dst)
@@ -189,7 +194,9 @@ class Bootstrap:
         python_diff = pkgutil.get_data(__package__, str(py_patch_path))
         patch(python_dir, python_diff)
         # copy frozen exxo modules to Python's stdlib
-        for fname in ('_exxo_importer.py', '_exxo_hack.py', '_exxo_elf.py'):
+        for fname in ('_exxo_importer.py', '_exxo_hack.py', '_exxo_elf.py', '_exxo_index.py',
+                      '_exxo_cache.py', '_exxo_trace.py', '_exxo_snapshot.py',
+                      '_exxo_reader.py'):
             pybuf = pkgutil.get_data(__package__, 'frozen/{}'.format(fname))
             dst = python_dir / 'Lib' / fname
             with dst.open('wb') as fp:
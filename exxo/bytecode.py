@@ -0,0 +1,159 @@
+import os
+import sys
+import subprocess
+import tempfile
+from pathlib import Path
+
+
+# runs inside target pyrun interpreter (python 2.7 or 3.x), since
+# bytecode format differs between python versions. source paths are
+# read from a file, one per line
+COMPILE_SCRIPT = """
+import os
+import sys
+import struct
+import marshal
+import py_compile
+
+try:
+    from importlib.util import cache_from_source, MAGIC_NUMBER
+except ImportError:
+    import imp
+    cache_from_source = None
+    MAGIC_NUMBER = imp.get_magic()
+
+optimize = int(sys.argv[1])
+sources = sys.argv[2]
+# deterministic builds: record paths relative to site-packages in code
+# objects
+basedir = sys.argv[3] if len(sys.argv) > 3 else None
+
+# magic, [flags,] source mtime, [source size]
+if sys.version_info >= (3, 7):
+    HEADER_SIZE, MTIME_OFFSET = 16, 8
+elif sys.version_info >= (3, 3):
+    HEADER_SIZE, MTIME_OFFSET = 12, 4
+else:
+    HEADER_SIZE, MTIME_OFFSET = 8, 4
+
+
+def bytecode_path(path):
+    if cache_from_source is not None:
+        return cache_from_source(path, optimization=optimize or '')
+    # python 2 writes .pyo files when optimizations are on
+    return path + ('o' if optimize else 'c')
+
+
+def is_up_to_date(path, cfile, dfile):
+    # bytecode of a build with other options must be replaced too: the
+    # optimization level is part of the file name and the path recorded
+    # in code objects tells deterministic builds apart. python 2 writes
+    # -O and -OO to the same .pyo, so those are always recompiled
+    if cache_from_source is None and optimize:
+        return False
+    try:
+        with open(cfile, 'rb') as fp:
+            header = fp.read(HEADER_SIZE)
+            if len(header) != HEADER_SIZE or header[:4] != MAGIC_NUMBER:
+                return False
+            if HEADER_SIZE == 16 and header[4:8] != b'\\0\\0\\0\\0':
+                # hash based bytecode
+                return False
+            mtime = struct.unpack('<I', header[MTIME_OFFSET:MTIME_OFFSET + 4])[0]
+            if mtime != int(os.stat(path).st_mtime) & 0xFFFFFFFF:
+                return False
+            code = marshal.load(fp)
+    except (IOError, EOFError, ValueError, TypeError):
+        return False
+    return code.co_filename == (dfile or path)
+
+
+with open(sources) as fp:
+    paths = fp.read().splitlines()
+
+for path in paths:
+    cfile = bytecode_path(path)
+    dfile = os.path.relpath(path, basedir) if basedir else None
+    if is_up_to_date(path, cfile, dfile):
+        continue
+    try:
+        if cache_from_source is not None:
+            py_compile.compile(path, cfile, dfile, doraise=True, optimize=optimize)
+        else:
+            py_compile.compile(path, cfile, dfile, doraise=True)
+    except py_compile.PyCompileError as e:
+        # some packages ship sources that don't compile on given python
+        # version (e.g. python 2 only modules or templates). pip ignores
+        # them too
+        sys.stderr.write('warning: failed to compile {0}: {1}\\n'.format(path, e.msg))
+"""
+
+def python_sources(site_packages):
+    for dirpath, dirnames, filenames in os.walk(str(site_packages)):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if fn.endswith('.py'):
+                yield os.path.join(dirpath, fn)
+
+
+def compile_tree(pyrun, site_packages, optimize=0, jobs=None, deterministic=False):
+    jobs = jobs or os.cpu_count() or 1
+    sources = list(python_sources(site_packages))
+    # interleave files, so that every process gets a similar share of
+    # big and small packages
+    chunks = [sources[i::jobs] for i in range(jobs)]
+    env = dict(os.environ)
+    # python 2 has no optimize parameter in py_compile.compile
+    env['PYTHONOPTIMIZE'] = str(optimize) if optimize else ''
+    extra_args = []
+    if deterministic:
+        # set and frozenset constants are marshalled in hash order
+        env['PYTHONHASHSEED'] = '0'
+        extra_args.append(str(site_packages))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        script = Path(tmpdir) / 'compile.py'
+        with script.open('w') as fp:
+            fp.write(COMPILE_SCRIPT)
+        procs = []
+        for i, chunk in enumerate(filter(None, chunks)):
+            chunk_file = Path(tmpdir) / 'sources-{}'.format(i)
+            with chunk_file.open('w') as fp:
+                fp.write('\n'.join(chunk))
+            procs.append(subprocess.Popen(
+                [str(pyrun), str(script), str(optimize), str(chunk_file)] + extra_args,
+                env=env))
+        for proc in procs:
+            if proc.wait() != 0:
+                sys.exit('bytecode compilation failed with return code: {}'
+                         .format(proc.returncode))
+    return len(sources)
+
+
+def bytecode_name(source, py_version, optimize):
+    # archive name of bytecode file compiled from given source, as
+    # looked up by zipimport
+    base, _ = os.path.splitext(source)
+    if py_version.startswith('2'):
+        return base + ('.pyo' if optimize else '.pyc')
+    dirname, fn = os.path.split(base)
+    tag = 'cpython-{}'.format(py_version.replace('.', ''))
+    opt = '.opt-{}'.format(optimize) if optimize else ''
+    return '{}/__pycache__/{}.{}{}.pyc'.format(dirname, fn, tag, opt).lstrip('/')
+
+
+class SourceStripper:
+    def __init__(self, py_version, optimize=0):
+        self.py_version = py_version
+        self.optimize = optimize
+        self.stats = {'stripped': 0}
+
+    def filter(self, entries):
+        names = {name for name, _ in entries}
+        result = []
+        for name, path in entries:
+            if (name.endswith('.py') and
+                    bytecode_name(name, self.py_version, self.optimize) in names):
+                self.stats['stripped'] += 1
+                continue
+            result.append((name, path))
+        return result
@@ -0,0 +1,152 @@
+import os
+import lzma
+import struct
+import hashlib
+import zipfile
+from pathlib import Path
+from .archive import HASH_BUFSIZE
+
+
+# patch layout: header followed by an xz stream of copy/insert
+# operations that rebuild the new binary from the old one
+MAGIC = b'EXXODLT1'
+HEADER = struct.Struct('<8sQ32sQ32s')
+OP_COPY = b'C'
+OP_INSERT = b'I'
+COPY = struct.Struct('<QQ')
+INSERT = struct.Struct('<Q')
+
+
+class DeltaError(Exception):
+    pass
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(str(path), 'rb') as fp:
+        while True:
+            buf = fp.read(HASH_BUFSIZE)
+            if not buf:
+                break
+            h.update(buf)
+    return h.digest()
+
+
+def segments(path):
+    # split an exxo binary on zip member boundaries: pyrun prefix, one
+    # segment per member (local header, data and alignment padding) and
+    # the central directory. unchanged members of a deterministic build
+    # are byte-identical segments, wherever they moved to
+    size = os.path.getsize(str(path))
+    try:
+        with zipfile.ZipFile(str(path)) as zf:
+            offsets = sorted(info.header_offset for info in zf.infolist())
+            offsets.append(zf.start_dir)
+    except zipfile.BadZipFile:
+        offsets = []
+    bounds = [0] + [o for o in offsets if 0 < o < size] + [size]
+    bounds = sorted(set(bounds))
+    return list(zip(bounds, bounds[1:]))
+
+
+def segment_digests(fp, spans):
+    for start, end in spans:
+        fp.seek(start)
+        yield hashlib.sha1(fp.read(end - start)).digest(), start, end
+
+
+class DeltaWriter:
+    def __init__(self, out):
+        self.out = out
+        self.pending = None
+        self.stats = {'copied': 0, 'inserted': 0}
+
+    def copy(self, offset, length):
+        # merge with previous copy, if contiguous in the old file
+        if self.pending is not None and sum(self.pending) == offset:
+            self.pending[1] += length
+        else:
+            self.flush()
+            self.pending = [offset, length]
+        self.stats['copied'] += length
+
+    def insert(self, data):
+        self.flush()
+        self.out.write(OP_INSERT + INSERT.pack(len(data)))
+        self.out.write(data)
+        self.stats['inserted'] += len(data)
+
+    def flush(self):
+        if self.pending is not None:
+            self.out.write(OP_COPY + COPY.pack(*self.pending))
+            self.pending = None
+
+
+def create_delta(old, new, patch):
+    with open(str(old), 'rb') as old_fp:
+        known = {}
+        for digest, start, end in segment_digests(old_fp, segments(old)):
+            known.setdefault((digest, end - start), start)
+    header = HEADER.pack(MAGIC, os.path.getsize(str(old)), sha256_file(old),
+                         os.path.getsize(str(new)), sha256_file(new))
+    with open(str(patch), 'wb') as patch_fp, open(str(new), 'rb') as new_fp:
+        patch_fp.write(header)
+        with lzma.LZMAFile(patch_fp, 'wb', preset=9) as out:
+            writer = DeltaWriter(out)
+            for start, end in segments(new):
+                new_fp.seek(start)
+                data = new_fp.read(end - start)
+                offset = known.get((hashlib.sha1(data).digest(), len(data)))
+                if offset is None:
+                    writer.insert(data)
+                else:
+                    writer.copy(offset, len(data))
+            writer.flush()
+    return writer.stats
+
+
+def read_exactly(fp, n):
+    data = fp.read(n)
+    if len(data) != n:
+        raise DeltaError('truncated patch')
+    return data
+
+
+def apply_delta(old, patch, new):
+    new = Path(new)
+    with open(str(patch), 'rb') as patch_fp:
+        magic, old_size, old_digest, new_size, new_digest = HEADER.unpack(
+            read_exactly(patch_fp, HEADER.size))
+        if magic != MAGIC:
+            raise DeltaError('not an exxo patch: {}'.format(patch))
+        if os.path.getsize(str(old)) != old_size or sha256_file(old) != old_digest:
+            raise DeltaError('patch was made against a different binary than {}'.format(old))
+        tmp = new.with_name(new.name + '.tmp')
+        h = hashlib.sha256()
+        with open(str(old), 'rb') as old_fp, tmp.open('wb') as out, \
+                lzma.LZMAFile(patch_fp, 'rb') as ops:
+            while True:
+                op = ops.read(1)
+                if not op:
+                    break
+                if op == OP_COPY:
+                    offset, length = COPY.unpack(read_exactly(ops, COPY.size))
+                    old_fp.seek(offset)
+                    while length:
+                        data = read_exactly(old_fp, min(length, HASH_BUFSIZE))
+                        h.update(data)
+                        out.write(data)
+                        length -= len(data)
+                elif op == OP_INSERT:
+                    length, = INSERT.unpack(read_exactly(ops, INSERT.size))
+                    data = read_exactly(ops, length)
+                    h.update(data)
+                    out.write(data)
+                else:
+                    raise DeltaError('corrupted patch: unknown operation {!r}'.format(op))
+    if tmp.stat().st_size != new_size or h.digest() != new_digest:
+        tmp.unlink()
+        raise DeltaError('patched binary does not match the expected checksum')
+    tmp.chmod(os.stat(str(old)).st_mode & 0o7777)
+    tmp.rename(new)
+    return new
@@ -9,32 +9,33 @@ import tarfile
 import tempfile
 import zipfile
 import io
-import zipapp
 from pathlib import Path
 import jinja2
-from .bootstrap import PYTHON_VERSION_MAP, ensure_dir_exists
+from .archive import ArchiveBuilder, CompressionPolicy, ZIP_EPOCH, file_digest, parse_entry_point
+from .prune import Pruner
+from .bytecode import compile_tree, SourceStripper
+from .snapshot import SnapshotBuilder
+from .wheelhouse import Wheelhouse
+from .delta import DeltaError, create_delta, apply_delta
+from .bootstrap import PYTHON_VERSION_MAP, ensure_dir_exists, user_cache_dir
 from .venv import ACTIVATE_SCRIPT, PIP_SCRIPT
 
 
-def create_binary(dst_path, pyrun, zip_file, compress_pyrun):
-    if compress_pyrun:
-        pyrun_upx = pyrun.with_name(pyrun.name + '.compressed')
-        if not pyrun_upx.exists():
-            pyrun_upx_tmp = pyrun_upx.with_name(pyrun_upx.name + '.tmp')
-            shutil.copy(str(pyrun), str(pyrun_upx_tmp))
-            try:
-                subprocess.check_call(['upx', str(pyrun_upx_tmp)])
-            except FileNotFoundError:
-                sys.exit('error: compression is enabled, but upx command was not found')
-            pyrun_upx_tmp.rename(pyrun_upx)
-        pyrun = pyrun_upx
-    basedir = dst_path.parent
-    if basedir:
-        ensure_dir_exists(basedir)
-    with dst_path.open('wb') as dst_fp, pyrun.open('rb') as pyrun_fp, zip_file.open('rb') as zip_fp:
-        shutil.copyfileobj(pyrun_fp, dst_fp)
-        shutil.copyfileobj(zip_fp, dst_fp)
-    dst_path.chmod(0o0755)
+def compressed_pyrun(pyrun):
+    # keyed by content, so that a rebuilt pyrun never picks up a stale
+    # upx output
+    pyrun_upx = user_cache_dir('upx', file_digest(pyrun))
+    if not pyrun_upx.exists():
+        ensure_dir_exists(pyrun_upx.parent)
+        pyrun_upx_tmp = pyrun_upx.with_name('{}.{}.tmp'.format(pyrun_upx.name, os.getpid()))
+        shutil.copy(str(pyrun), str(pyrun_upx_tmp))
+        try:
+            subprocess.check_call(['upx', str(pyrun_upx_tmp)])
+        except FileNotFoundError:
+            pyrun_upx_tmp.unlink()
+            sys.exit('error: compression is enabled, but upx command was not found')
+        pyrun_upx_tmp.rename(pyrun_upx)
+    return pyrun_upx
 
 
 def create_virtualenv(args):
@@ -82,7 +83,7 @@ def get_project_name(source_path):
     return lines[-1]
 
 
-def get_entry_point(source_path, project_name=None):
+def get_entry_points(source_path, project_name=None):
     project_name = project_name or get_project_name(source_path)
     conf = configparser.ConfigParser()
     with tempfile.TemporaryDirectory() as tempdir:
@@ -94,11 +95,22 @@ def get_entry_point(source_path, project_name=None):
     if not conf.has_section('console_scripts'):
         sys.exit('no "console_scripts" entry point in setup.py. either provide it or '
                  'use --main parameter')
-    keys = conf.options('console_scripts')
-    if len(keys) != 1:
-        # TODO; fix it
-        sys.exit('only one console script can be used for now')
-    return conf.get('console_scripts', keys[0])
+    return {name: conf.get('console_scripts', name)
+            for name in conf.options('console_scripts')}
+
+
+def create_links(dst_bin, names):
+    # multi-call binary: every console script is a symlink to it
+    for name in names:
+        link = dst_bin.with_name(name)
+        if link == dst_bin:
+            continue
+        if link.is_symlink():
+            link.unlink()
+        elif link.exists():
+            print('warning: not replacing {} with a symlink'.format(link))
+            continue
+        link.symlink_to(dst_bin.name)
 
 
 def build(args):
@@ -111,15 +123,103 @@ def build(args):
         sys.exit('current virtualenv is not an exxo virtualenv')
     pyrun = envdir / 'bin' / 'pyrun{}'.format(py_version)
     site_packages = envdir / 'lib' / 'python{}'.format(py_version) / 'site-packages'
-    zip_file = envdir / 'app.zip'
     # make sure pip undestands it as a local directory
     source_path = args.source_path.rstrip(os.sep) + os.sep
     project_name = get_project_name(source_path)
-    entry_point = args.main or get_entry_point(source_path, project_name)
-    subprocess.check_call(['pip', 'install', '-U', source_path])
+    if args.main:
+        entry_points = {project_name: args.main}
+    else:
+        entry_points = get_entry_points(source_path, project_name)
+    if args.lock:
+        wheelhouse = Wheelhouse(args.lock, args.wheelhouse, envdir, site_packages, pyrun)
+        wheelhouse.install(project_name, source_path)
+        print('dependencies: {installed} installed, {removed} removed, '
+              'restored from cache: {cached}'.format(**wheelhouse.stats))
+    else:
+        subprocess.check_call(['pip', 'install', '-U', source_path])
     dst_bin = Path(args.output or (Path(source_path) / 'dist' / project_name))
-    zipapp.create_archive(site_packages, zip_file, main=entry_point)
-    create_binary(dst_bin, pyrun, zip_file, args.compress_pyrun)
+    if args.compile:
+        compile_tree(pyrun, site_packages, optimize=args.optimize, jobs=args.jobs,
+                     deterministic=args.deterministic)
+    filters = []
+    pruner = stripper = None
+    if args.prune:
+        roots = [parse_entry_point(e)[0] for e in entry_points.values()]
+        pruner = Pruner(roots, keep=args.keep, record=args.prune_record)
+        filters.append(pruner.filter)
+    if args.strip_sources:
+        stripper = SourceStripper(py_version, optimize=args.optimize)
+        filters.append(stripper.filter)
+    snapshot = None
+    if args.snapshot_from:
+        snapshot = SnapshotBuilder(read_lines(args.snapshot_from), py_version,
+                                   optimize=args.optimize)
+    builder = ArchiveBuilder(site_packages, main=entry_points,
+                             default=project_name if project_name in entry_points else None,
+                             manifest=envdir / 'build.manifest',
+                             incremental=not args.clean,
+                             policy=args.compression, jobs=args.jobs,
+                             filters=filters,
+                             epoch=source_date_epoch() if args.deterministic else None,
+                             index=True, prefetch=read_lines(args.prefetch),
+                             layout=read_lines(args.layout_from),
+                             snapshot=snapshot)
+    if args.compress_pyrun:
+        pyrun = compressed_pyrun(pyrun)
+    if dst_bin.parent:
+        ensure_dir_exists(dst_bin.parent)
+    builder.build(dst_bin, prefix=pyrun)
+    dst_bin.chmod(0o0755)
+    if args.links:
+        create_links(dst_bin, entry_points)
+    print('archive: {reused} files reused, {compressed} compressed'.format(**builder.stats))
+    if pruner:
+        print('archive: {kept} files kept, {dropped} pruned'.format(**pruner.stats))
+    if stripper:
+        print('archive: {stripped} source files stripped'.format(**stripper.stats))
+    if snapshot:
+        print('archive: {modules} modules in startup snapshot'.format(**snapshot.stats))
+
+
+def read_lines(path):
+    if path is None:
+        return []
+    with open(path) as fp:
+        return [line.strip() for line in fp if line.strip()]
+
+
+def source_date_epoch():
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if not value:
+        return ZIP_EPOCH
+    try:
+        # zip can't express dates before 1980
+        return max(int(value), ZIP_EPOCH)
+    except ValueError:
+        sys.exit('invalid SOURCE_DATE_EPOCH: {}'.format(value))
+
+
+def make_delta(args):
+    try:
+        stats = create_delta(args.old, args.new, args.output)
+    except (OSError, DeltaError) as e:
+        sys.exit('error: {}'.format(e))
+    print('{}: {} bytes ({copied} bytes copied, {inserted} bytes inserted)'.format(
+        args.output, os.path.getsize(args.output), **stats))
+
+
+def apply_patch(args):
+    try:
+        apply_delta(args.old, args.patch, args.output or args.old)
+    except (OSError, DeltaError) as e:
+        sys.exit('error: {}'.format(e))
+
+
+def compression_policy(spec):
+    try:
+        return CompressionPolicy.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 def main():
@@ -138,8 +238,74 @@ def main():
     parser_build.add_argument('-s', '--source-path', default='.', help='path to project source')
     parser_build.add_argument('-c', '--compress-pyrun', action='store_true',
                               help='compress pyrun binary with upx')
+    parser_build.add_argument('--links', action='store_true',
+                              help='create a symlink to the binary for every console script')
+    parser_build.add_argument('--clean', action='store_true',
+                              help='rebuild the archive from scratch instead of reusing '
+                                   'unchanged files from the previous build')
+    parser_build.add_argument('-j', '--jobs', type=int,
+                              help='number of compression processes (default: number of cpus)')
+    parser_build.add_argument('--compression', type=compression_policy,
+                              default=CompressionPolicy(),
+                              help='compression level per file class, e.g. "pyc=stored,data=9". '
+                                   'classes: pyc (small bytecode files), media (already '
+                                   'compressed formats), native (shared libraries and '
+                                   'executables), data (files over 1MB), default. '
+                                   'levels: stored or 1-9')
+    parser_build.add_argument('--prune', action='store_true',
+                              help='leave out modules not reachable from the entry point')
+    parser_build.add_argument('--keep', action='append', default=[], metavar='MODULE',
+                              help='with --prune: always include given module and its '
+                                   'submodules (use for dynamic imports)')
+    parser_build.add_argument('--prune-record', metavar='FILE',
+                              help='with --prune: file with names of modules imported '
+                                   'during a recorded run, one per line')
+    parser_build.add_argument('--prefetch', metavar='FILE',
+                              help='file with names of modules imported during a recorded '
+                                   'run, one per line. their extension modules are extracted '
+                                   'in background at startup, if EXXO_PREFETCH=1 is set')
+    parser_build.add_argument('--layout-from', metavar='FILE',
+                              help='archive members recorded with EXXO_TRACE_IMPORTS=FILE. '
+                                   'they are put at the front of the archive in order of use '
+                                   'and read ahead at startup')
+    parser_build.add_argument('--snapshot-from', metavar='FILE',
+                              help='EXXO_TRACE_IMPORTS trace or module names, one per line. '
+                                   'code of these modules is bundled in one blob read at '
+                                   'startup, instead of importing modules one by one')
+    parser_build.add_argument('--no-compile', dest='compile', action='store_false',
+                              help="don't compile bytecode before building the archive")
+    parser_build.add_argument('-O', dest='optimize', action='count', default=0,
+                              help='compile optimized bytecode (-OO strips docstrings too)')
+    parser_build.add_argument('--strip-sources', action='store_true',
+                              help='leave out .py files that have compiled bytecode')
+    parser_build.add_argument('--lock', metavar='FILE',
+                              help='requirements file with pinned (and hashed) dependencies. '
+                                   'dependencies are installed offline from --wheelhouse')
+    parser_build.add_argument('--wheelhouse', metavar='DIR',
+                              help='directory with wheels of all locked dependencies')
+    parser_build.add_argument('--deterministic', action='store_true',
+                              help='reproducible build: same timestamp (SOURCE_DATE_EPOCH) and '
+                                   'normalized permissions for all files')
     parser_build.set_defaults(func=build)
+    parser_delta = subparsers.add_parser('delta', help='create binary patch between two builds')
+    parser_delta.add_argument('old', help='previous binary')
+    parser_delta.add_argument('new', help='new binary')
+    parser_delta.add_argument('-o', '--output', required=True, help='patch file')
+    parser_delta.set_defaults(func=make_delta)
+    parser_apply = subparsers.add_parser('apply', help='apply binary patch')
+    parser_apply.add_argument('old', help='binary to patch')
+    parser_apply.add_argument('patch', help='patch file created with "exxo delta"')
+    parser_apply.add_argument('-o', '--output',
+                              help='patched binary (default: replace old binary)')
+    parser_apply.set_defaults(func=apply_patch)
     args = parser.parse_args()
+    if args.func is build:
+        if args.optimize > 2:
+            parser.error('maximum optimization level is 2 (-OO)')
+        if args.strip_sources and not args.compile:
+            parser.error('--strip-sources requires bytecode compilation')
+        if bool(args.lock) != bool(args.wheelhouse):
+            parser.error('--lock and --wheelhouse must be used together')
     args.func(args)
 
 
@@ -0,0 +1,202 @@
+import os
+import time
+import errno
+import fcntl
+import shutil
+import tempfile
+import binascii
+
+
+# persistent cache of files extracted from the executable (extension
+# modules with their solib dependencies). disabled unless
+# EXXO_CACHE_DIR is set or EXXO_CACHE=1 (uses XDG cache directory).
+# entries live under a directory named after the build id of the
+# executable and are never modified once installed. every process using
+# a build holds a shared lock on its directory, garbage collection only
+# touches builds it can lock exclusively (i.e. nobody runs them)
+DEFAULT_MAX_AGE = 30  # days
+DEFAULT_MAX_SIZE = 1024  # MB
+TMP_PREFIX = '.tmp-'
+# leftovers of crashed processes
+TMP_MAX_AGE = 3600
+LOCK_NAME = '.lock'
+
+
+def cache_root():
+    path = os.environ.get('EXXO_CACHE_DIR')
+    if path:
+        return path
+    if os.environ.get('EXXO_CACHE', '0') in ('', '0'):
+        return None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'exxo')
+
+
+def ensure_private_dir(path):
+    # we dlopen files from there, so it has to be ours and not writable
+    # by anybody else
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def tree_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, fn)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def lock_build(build_dir, flags):
+    # fd of the lock file of a build directory, flock()ed with flags.
+    # None if the lock is taken (LOCK_NB) or the directory is gone
+    path = os.path.join(build_dir, LOCK_NAME)
+    while True:
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, flags)
+            st = os.fstat(fd)
+            cur = os.stat(path)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if getattr(e, 'errno', None) == errno.ENOENT:
+                # removed by garbage collection while we were waiting
+                continue
+            return None
+        if (st.st_dev, st.st_ino) == (cur.st_dev, cur.st_ino):
+            return fd
+        os.close(fd)
+
+
+class ExtractCache(object):
+    def __init__(self, root, build_id):
+        self.root = root
+        self.build_dir = os.path.join(root, binascii.hexlify(build_id).decode('ascii'))
+        self.max_age = env_int('EXXO_CACHE_MAX_AGE', DEFAULT_MAX_AGE) * 24 * 3600
+        self.max_size = env_int('EXXO_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE) * 1024 * 1024
+        self.lock_fd = None
+
+    @classmethod
+    def create(cls, build_id):
+        root = cache_root()
+        if root is None or build_id is None:
+            return None
+        cache = cls(root, build_id)
+        # the build directory may be removed by another process between
+        # creating and locking it
+        for _ in range(3):
+            if not (ensure_private_dir(root) and ensure_private_dir(cache.build_dir)):
+                return None
+            # held for the lifetime of the process
+            cache.lock_fd = lock_build(cache.build_dir, fcntl.LOCK_SH)
+            if cache.lock_fd is not None:
+                return cache
+        return None
+
+    def close(self):
+        # lets garbage collection of other processes remove the build
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def get(self, key, populate):
+        # returns directory of given entry. on a miss populate(dir) is
+        # called with a private directory, which is then renamed into
+        # place. concurrent processes may do the same, the first rename
+        # wins
+        target = os.path.join(self.build_dir, key)
+        if os.path.isdir(target):
+            try:
+                # last use time for garbage collection
+                os.utime(target, None)
+            except OSError:
+                pass
+            return target
+        tmp = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.build_dir)
+        try:
+            populate(tmp)
+            os.rename(tmp, target)
+        except OSError as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY) or not os.path.isdir(target):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        else:
+            self.collect_garbage()
+        return target
+
+    def collect_garbage(self):
+        # entries of the running build are never removed, only counted
+        now = time.time()
+        entries = []
+        total = 0
+        locks = []
+        try:
+            for build in os.listdir(self.root):
+                build_dir = os.path.join(self.root, build)
+                own = build_dir == self.build_dir
+                if not own:
+                    fd = lock_build(build_dir, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if fd is None:
+                        continue
+                    locks.append((build_dir, fd))
+                try:
+                    names = os.listdir(build_dir)
+                except OSError:
+                    continue
+                for name in names:
+                    if name == LOCK_NAME:
+                        continue
+                    path = os.path.join(build_dir, name)
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    if name.startswith(TMP_PREFIX):
+                        if now - mtime > TMP_MAX_AGE:
+                            shutil.rmtree(path, ignore_errors=True)
+                        continue
+                    if not own and now - mtime > self.max_age:
+                        shutil.rmtree(path, ignore_errors=True)
+                        continue
+                    size = tree_size(path)
+                    total += size
+                    if not own:
+                        entries.append((mtime, size, path))
+            # least recently used first
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            for build_dir, _ in locks:
+                try:
+                    if os.listdir(build_dir) == [LOCK_NAME]:
+                        os.unlink(os.path.join(build_dir, LOCK_NAME))
+                        os.rmdir(build_dir)
+                except OSError:
+                    pass
+        finally:
+            for _, fd in locks:
+                os.close(fd)
@@ -2,7 +2,6 @@ import sys
 import os
 import posix
 import stat
-import zipfile
 import errno
 from _exxo_importer import exxo_importer
 
@@ -23,13 +22,16 @@ def cached(func):
 
 @cached
 def _get_inzip_path(filename, exc):
-    if not zipfile.is_zipfile(sys.executable):
+    if not exxo_importer.enabled:
         raise exc(errno.ENOENT, filename)
     inzip_path = filename[len(sys.executable):].lstrip('/')
-    if inzip_path not in exxo_importer.exe_names:
+    if not inzip_path:
+        # root of the archive
+        return inzip_path, True
+    if not exxo_importer.has_member(inzip_path):
         # try a directory
         inzip_path = inzip_path + '/'
-        if inzip_path not in exxo_importer.exe_names:
+        if not exxo_importer.has_member(inzip_path):
             raise exc(errno.ENOENT, filename)
     is_dir = inzip_path.endswith('/')
     return inzip_path, is_dir
@@ -37,26 +39,91 @@ def _get_inzip_path(filename, exc):
 
 def get_file(filename):
     inzip_path, _ = _get_inzip_path(filename, IOError)
-    return exxo_importer.exe_zip.open(inzip_path)
+    return exxo_importer.open_member(inzip_path)
 
 
 @cached
 def stat_file(filename):
     inzip_path, is_dir = _get_inzip_path(filename, OSError)
-    info = exxo_importer.exe_zip.getinfo(inzip_path)
-    stat_result = list(os.stat(sys.executable))
-    stat_result[6] = info.file_size
-    if is_dir:
+    _, size, mode, mtime = exxo_importer.member_stat(inzip_path)
+    stat_result = list(_exe_stat())
+    stat_result[6] = size
+    if mode:
+        stat_result[0] = mode
+    elif is_dir:
         stat_result[0] &= ~(stat.S_IFREG | stat.S_IFLNK)
         stat_result[0] |= stat.S_IFDIR
+    if mtime is not None:
+        stat_result[8] = mtime
     return posix.stat_result(stat_result)
 
 
 @cached
-def listdir(directory):
+def _exe_stat():
+    return os.stat(sys.executable)
+
+
+def ca_cache_key(cafile):
+    # key of parsed certificates of a cafile inside the executable in
+    # _ssl, None for other files. the executable is stat'ed every time,
+    # so a replaced binary doesn't reuse certificates of the old one
+    if isinstance(cafile, bytes) and not isinstance(cafile, str):
+        cafile = cafile.decode(sys.getfilesystemencoding())
+    try:
+        if not cafile.startswith(sys.executable + '/'):
+            return None
+    except AttributeError:
+        return None
+    if not exxo_importer.enabled:
+        return None
+    if not exxo_importer.has_member(cafile[len(sys.executable):].lstrip('/')):
+        return None
+    st = os.stat(sys.executable)
+    return cafile, st.st_ino, st.st_size, st.st_mtime
+
+
+@cached
+def _listdir_entries(directory):
     fixed_directory = directory.rstrip('/') + '/'
     inzip_path, is_dir = _get_inzip_path(fixed_directory, OSError)
     if not is_dir:
         raise OSError(errno.ENOTDIR, directory)
-    return [n[len(inzip_path):] for n in exxo_importer.exe_names
-            if n != inzip_path and n.startswith(inzip_path)]
+    return exxo_importer.member_listdir(inzip_path)
+
+
+def listdir(directory):
+    return [name for name, _ in _listdir_entries(directory)]
+
+
+class DirEntry(object):
+    # os.DirEntry counterpart for directories inside the executable
+    def __init__(self, directory, name, is_dir):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._is_dir = is_dir
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_dir
+
+    def is_file(self, follow_symlinks=True):
+        return not self._is_dir
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        return stat_file(self.path)
+
+    def inode(self):
+        return self.stat().st_ino
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return '<DirEntry {0!r}>'.format(self.name)
+
+
+def scandir(directory):
+    return iter([DirEntry(directory, name, is_dir)
+                 for name, is_dir in _listdir_entries(directory)])
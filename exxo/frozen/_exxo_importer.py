@@ -1,24 +1,305 @@
 import sys
 import os
-import zipfile
-import sysconfig
-import shutil
-import tempfile
-import imp
-import warnings
+import errno
+try:
+    from _thread import allocate_lock
+except ImportError:
+    from thread import allocate_lock
+try:
+    import _exxo_index
+except ImportError:
+    # for unit tests
+    from . import _exxo_index
+
+# this module is imported by every exxo binary at startup. anything else
+# is imported on first use, so that programs that never touch the
+# archive don't pay for it
+
+
+LOCAL_HEADER = '<4s5H3L2H'
+
+MFD_CLOEXEC = 1
+# for libc without memfd_create wrapper (glibc < 2.27)
+SYS_MEMFD_CREATE = {
+    'x86_64': 319,
+    'i386': 356,
+    'i686': 356,
+    'aarch64': 279,
+    'armv7l': 385,
+}
+RTLD_GLOBAL = 0x100
+RTLD_NOW = 2
+RTLD_NOLOAD = 4
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    # copy a byte range between files without passing data through
+    # userspace. returns False if the kernel can't do it for us
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None)
+    while count > 0:
+        try:
+            if copy_file_range is not None:
+                n = copy_file_range(src_fd, dst_fd, count, offset)
+            elif sendfile is not None:
+                n = sendfile(dst_fd, src_fd, offset, count)
+            else:
+                return False
+        except OSError:
+            if copy_file_range is None:
+                return False
+            # e.g. EXDEV on older kernels. try sendfile instead
+            copy_file_range = None
+            continue
+        if n == 0:
+            raise IOError('unexpected end of file')
+        offset += n
+        count -= n
+    return True
+
+
+def memfd_create(name):
+    func = getattr(os, 'memfd_create', None)
+    if func is not None:
+        return func(name, MFD_CLOEXEC)
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    try:
+        fd = libc.memfd_create(name, MFD_CLOEXEC)
+    except AttributeError:
+        nr = SYS_MEMFD_CREATE.get(os.uname()[4])
+        if nr is None:
+            raise OSError(errno.ENOSYS, 'memfd_create is not supported')
+        fd = libc.syscall(nr, name, MFD_CLOEXEC)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+def resolve_rpath(rpath, zip_path):
+    # RPATH (':' separated) with $ORIGIN of an archive member replaced
+    origin = os.path.dirname(zip_path)
+    return ':'.join(os.path.normpath(entry.replace('$ORIGIN', origin))
+                    for entry in rpath.split(':'))
 
 
 class ModuleImporter(object):
     def __init__(self):
-        if not zipfile.is_zipfile(sys.executable):
-            self.exe_zip = None
-            return
-        self.exe_zip = zipfile.ZipFile(sys.executable, 'r')
-        self.exe_names = self.exe_zip.namelist()
-        self.ext_suffix = sysconfig.get_config_var('SO')
+        self.executable = sys.executable
+        self._opened = False
+        self._index_tried = False
+        self._exe_index = None
+        self._exe_zip = None
+        self._ext_suffix = None
+        self._cache = False
+        self._file_cache = None
+        self._checkpoints = None
+        # bundled executables extracted for subprocess: member -> path
+        self._executables = {}
+        # ctypes libraries: member -> path, (member, mode) -> handle
+        self._library_paths = {}
+        self._dl_handles = {}
+        self._private_root = None
+        # guards extraction of executables and ctypes libraries
+        self._extract_lock = allocate_lock()
+        # process the paths above belong to, see _check_fork
+        self._pid = os.getpid()
+        self._solibs = False
+        # EXXO_EXTRACT_MODE=memfd loads extensions from anonymous memory
+        # instead of files, if the kernel supports it
+        self.extract_mode = os.environ.get('EXXO_EXTRACT_MODE', 'file')
+        # memory files stay open for the lifetime of the process:
+        # dynamic linker identifies loaded libraries by path, so a
+        # /proc/self/fd/N path must never point to another file
+        self._memfds = []
+        self._memfd_handles = []
+        # member name -> PrefetchJob
+        self._prefetch_jobs = {}
+        self._prefetch_cancelled = False
+        # set by EXXO_TRACE_IMPORTS
+        self.tracer = None
+
+    def _open_index(self):
+        self._index_tried = True
+        try:
+            # index built by exxo build: no need to parse the central
+            # directory
+            self._exe_index = _exxo_index.ArchiveIndex(self.executable)
+        except (IOError, OSError, ValueError):
+            self._exe_index = None
+
+    def _open(self):
+        self._opened = True
+        if not self._index_tried:
+            self._open_index()
+        if self._exe_index is None:
+            import zipfile
+            if not zipfile.is_zipfile(self.executable):
+                return
+            self._exe_zip = zipfile.ZipFile(self.executable, 'r')
+            self.exe_names = set(self._exe_zip.namelist())
+            self.exe_tree = None
+
+    @property
+    def exe_index(self):
+        if not self._opened:
+            self._open()
+        return self._exe_index
+
+    @property
+    def startup_index(self):
+        # like exe_index, but never falls back to zipfile: work done on
+        # every interpreter start only concerns binaries built by exxo
+        if not self._index_tried:
+            self._open_index()
+        return self._exe_index
+
+    @property
+    def exe_zip(self):
+        if not self._opened:
+            self._open()
+        return self._exe_zip
+
+    @property
+    def ext_suffix(self):
+        if self._ext_suffix is None:
+            import sysconfig
+            # same value in python 3.5, SO is gone since 3.10
+            self._ext_suffix = (sysconfig.get_config_var('EXT_SUFFIX') or
+                                sysconfig.get_config_var('SO'))
+        return self._ext_suffix
+
+    @property
+    def cache(self):
+        # persistent extraction cache, if enabled (see _exxo_cache)
+        if self._cache is False:
+            self._cache = None
+            if self.exe_index is not None:
+                try:
+                    import _exxo_cache
+                except ImportError:
+                    # for unit tests
+                    from . import _exxo_cache
+                self._cache = _exxo_cache.ExtractCache.create(self.exe_index.build_id)
+        return self._cache
+
+    @property
+    def solibs(self):
+        # bundled dependencies of extension modules resolved by exxo
+        # build. None for archives without the manifest
+        if self._solibs is False:
+            self._solibs = None
+            if self.enabled and self.has_member(_exxo_index.SOLIBS_NAME):
+                with self.open_member(_exxo_index.SOLIBS_NAME) as fp:
+                    self._solibs = _exxo_index.load_solibs(fp.read())
+        return self._solibs
+
+    @property
+    def checkpoints(self):
+        # restart points of large deflated members, index mode only
+        if self._checkpoints is None:
+            self._checkpoints = {}
+            entry = self.exe_index.lookup(_exxo_index.CHECKPOINTS_NAME)
+            if entry is not None:
+                self._checkpoints = _exxo_index.load_checkpoints(self.exe_index.read(entry))
+        return self._checkpoints
+
+    @property
+    def enabled(self):
+        return self.exe_index is not None or self.exe_zip is not None
+
+    def has_member(self, name):
+        if self.exe_index is not None:
+            return name in self.exe_index
+        return name in self.exe_names
+
+    def member_stat(self, name):
+        # (is_dir, size, mode, mtime) of given member. mode is None if
+        # unknown, mtime is None for '', the archive root
+        if self.exe_index is not None:
+            if not name:
+                return True, 0, _exxo_index.DIR_MODE, None
+            entry = self.exe_index.lookup(name)
+            return bool(entry.flags & _exxo_index.FLAG_DIR), entry.size, entry.mode, entry.mtime
+        if not name:
+            return True, 0, None, None
+        import time
+        info = self.exe_zip.getinfo(name)
+        # zip timestamps are local time, like zipimport reads them
+        mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+        return name.endswith('/'), info.file_size, (info.external_attr >> 16) or None, mtime
+
+    def member_listdir(self, name):
+        # (base name, is_dir) of members in given directory ('pkg/' or
+        # '' for the archive root)
+        if self.exe_index is not None:
+            entry = self.exe_index.lookup(name) if name else None
+            result = []
+            for e in self.exe_index.listdir(entry):
+                base = e.name.rstrip(b'/').rpartition(b'/')[2]
+                if not isinstance(base, str):
+                    base = base.decode('utf-8')
+                result.append((base, bool(e.flags & _exxo_index.FLAG_DIR)))
+            return result
+        if self.exe_tree is None:
+            tree = {}
+            for n in sorted(self.exe_names):
+                parent = _exxo_index.parent_dir(n)
+                tree.setdefault(parent, []).append((n[len(parent):].rstrip('/'),
+                                                    n.endswith('/')))
+            self.exe_tree = tree
+        return list(self.exe_tree.get(name, []))
+
+    def open_member(self, name):
+        if self.tracer is not None:
+            self.tracer.record(name)
+        _exxo_reader = self._reader_module()
+        if self.exe_index is None:
+            # the member is read under ZipFile lock once, later reads
+            # don't touch the shared file
+            info = self.exe_zip.getinfo(name)
+            return _exxo_reader.MemberReader(name, self._cached_data(
+                (info.header_offset, info.CRC), lambda: self.exe_zip.read(name)))
+        entry = self.exe_index.lookup(name)
+        if entry is None:
+            raise KeyError(name)
+        points = self.checkpoints.get(name)
+        if points:
+            return _exxo_reader.InflatingReader(name, self.exe_index.mm, entry.offset,
+                                                entry.compress_size, entry.size, points)
+        if entry.flags & _exxo_index.FLAG_DEFLATED:
+            return _exxo_reader.MemberReader(name, self._cached_data(
+                (entry.offset, entry.crc), lambda: self.exe_index.read(entry)))
+        return _exxo_reader.MemberReader(name, self.exe_index.mm, entry.offset, entry.size)
+
+    def _reader_module(self):
+        try:
+            import _exxo_reader
+        except ImportError:
+            # for unit tests
+            from . import _exxo_reader
+        return _exxo_reader
+
+    @property
+    def file_cache(self):
+        # EXXO_FILE_CACHE_SIZE: cache of inflated members for open()
+        if self._file_cache is None:
+            self._file_cache = self._reader_module().FileCache.create()
+        return self._file_cache
+
+    def _cached_data(self, key, read):
+        cache = self.file_cache
+        data = cache.get(key)
+        if data is None:
+            data = read()
+            cache.put(key, data)
+        return data
 
     def find_spec(self, fullname, path, target=None):
-        if self.exe_zip is None:
+        if not self.enabled:
             return
         from importlib.machinery import ModuleSpec
         path = self._get_path_in_zip(fullname)
@@ -26,13 +307,13 @@ class ModuleImporter(object):
             return ModuleSpec(fullname, self, origin=path)
 
     def find_module(self, fullname, path=None):
-        if self.exe_zip is None:
+        if not self.enabled:
             return
         path = self._get_path_in_zip(fullname)
         return self if path else None
 
     def load_module(self, fullname):
-        if self.exe_zip is None:
+        if not self.enabled:
             return
         if fullname in sys.modules:
             return sys.modules[fullname]
@@ -41,39 +322,417 @@ class ModuleImporter(object):
             assert spec is not None
             path = spec.origin
         else:
+            spec = None
             path = self._get_path_in_zip(fullname)
         assert path is not None
-        so_file = os.path.basename(path)
-        tmpdir = tempfile.mkdtemp()
-        tmp_path = os.path.join(tmpdir, so_file)
+        if self.extract_mode == 'memfd':
+            mod = self._load_from_memory(fullname, path, spec)
+            if mod is not None:
+                return mod
+        tmpdir = so_path = None
+        job = self._prefetch_jobs.pop(path, None)
+        if job is not None:
+            # wait for the prefetch thread to get to this one
+            job.lock.acquire()
+            tmpdir, so_path = job.tmpdir, job.so_path
         try:
-            self._extract_so_file(path, tmp_path)
-            self._handle_rpath(path, tmp_path)
-            if sys.version_info[0] == 2:
-                name = fullname.split('.')[-1]
-                mod = imp.load_dynamic(name, tmp_path)
-            else:
-                from importlib.machinery import ExtensionFileLoader
-                loader = ExtensionFileLoader(fullname, tmp_path)
-                spec.origin = tmp_path
-                mod = loader.create_module(spec)
-            sys.modules[fullname] = mod
-            return mod
+            if so_path is None:
+                if tmpdir is None and self.cache is None:
+                    import tempfile
+                    tmpdir = tempfile.mkdtemp()
+                so_path = self._extract(path, tmpdir)
+            return self._load_extension(fullname, so_path, spec)
         finally:
+            if tmpdir is not None:
+                import shutil
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def _extract(self, path, tmpdir):
+        # extension module with its dependencies goes either to the
+        # persistent cache or to tmpdir
+        cache = self.cache
+        if cache is None:
+            return self._extract_with_deps(path, tmpdir)
+        key = '{0}-{1:08x}'.format(self._module_name(path), self.exe_index.lookup(path).crc)
+        cache_dir = cache.get(key, lambda dst_dir: self._extract_with_deps(path, dst_dir))
+        return os.path.join(cache_dir, os.path.basename(path))
+
+    def executable_path(self, name):
+        # bundled executable run by subprocess: extracted once per
+        # process or, with the persistent cache, once per build. None if
+        # there's no such member
+        self._check_fork()
+        path = self._executables.get(name)
+        if path is not None or not self.enabled or not self.has_member(name):
+            return path
+        with self._extract_lock:
+            path = self._executables.get(name)
+            if path is None:
+                cache = self.cache
+                if cache is not None:
+                    key = '{0}-{1:08x}'.format(name.replace('/', '.'),
+                                               self.exe_index.lookup(name).crc)
+                    path = os.path.join(cache.get(key, lambda dst_dir: self._extract_executable(
+                        name, dst_dir)), os.path.basename(name))
+                else:
+                    path = self._extract_executable(name, self._private_dir(os.path.dirname(name)))
+                self._executables[name] = path
+        return path
+
+    def _extract_executable(self, name, dst_dir):
+        # keeps the name: some tools look at their argv[0]. written
+        # under a temporary name and renamed, so that nobody (another
+        # process sharing the cache directory included) ever execs a
+        # partial file
+        path = os.path.join(dst_dir, os.path.basename(name))
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            self._extract_so_file(name, tmp)
+            os.rename(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return path
+
+    def dlopen(self, path, mode):
+        # ctypes.CDLL of a library inside the executable. the library is
+        # extracted with its bundled dependencies like an extension
+        # module, handles are cached by member and mode, so loading it
+        # again is a dict lookup. None if path isn't in the archive
+        prefix = self.executable + '/'
+        if not isinstance(path, str) or not path.startswith(prefix):
+            return None
+        name = path[len(prefix):]
+        self._check_fork()
+        handle = self._dl_handles.get((name, mode))
+        if handle is not None or not self.enabled or not self.has_member(name):
+            return handle
+        with self._extract_lock:
+            handle = self._dl_handles.get((name, mode))
+            if handle is None:
+                import _ctypes
+                so_path = self._library_paths.get(name)
+                if so_path is None:
+                    # a directory per library: a library loaded before
+                    # must never be overwritten by dependencies of another
+                    so_path = self._extract(name, None if self.cache is not None
+                                            else self._private_dir(name))
+                    self._library_paths[name] = so_path
+                try:
+                    handle = _ctypes.dlopen(so_path, mode)
+                except OSError:
+                    if self.cache is None or not so_path.startswith(self.cache.build_dir):
+                        raise
+                    # the cache directory may be mounted noexec or its
+                    # copy damaged: extract it privately and try again
+                    so_path = self._extract_with_deps(name, self._private_dir(name))
+                    self._library_paths[name] = so_path
+                    handle = _ctypes.dlopen(so_path, mode)
+                self._dl_handles[(name, mode)] = handle
+        return handle
+
+    def _check_fork(self):
+        # a forked child inherits paths into the private directory of
+        # its parent, which the parent removes at exit, and possibly a
+        # lock held by another parent thread. loaded libraries stay
+        # mapped, so dlopen handles remain valid
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._extract_lock = allocate_lock()
+            self._executables = {}
+            self._library_paths = {}
+            self._private_root = None
+
+    def _private_dir(self, name):
+        # directory of this process for extracted files, removed at exit
+        if self._private_root is None:
+            import atexit
+            import tempfile
+            self._private_root = tempfile.mkdtemp()
+            atexit.register(self._remove_private_root, self._private_root, os.getpid())
+        path = os.path.join(self._private_root, name)
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return path
+
+    @staticmethod
+    def _remove_private_root(path, pid):
+        # forked children inherit the atexit hook, but not the directory
+        if os.getpid() == pid:
+            import shutil
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _module_name(path):
+        return path.partition('.')[0].replace('/', '.')
+
+    def startup(self):
+        # called by pyrun once the importer is installed
+        path = os.environ.get('EXXO_TRACE_IMPORTS')
+        if path and self.enabled:
             try:
-                shutil.rmtree(tmpdir)
-            except OSError:
+                import _exxo_trace
+            except ImportError:
+                # for unit tests
+                from . import _exxo_trace
+            _exxo_trace.install(self, path)
+        self.readahead()
+        if not path:
+            # modules served from the snapshot would be missing in trace
+            self.load_snapshot()
+        self.start_prefetch()
+
+    def load_snapshot(self):
+        # code of modules imported at startup, put together by exxo build
+        # --snapshot-from. EXXO_SNAPSHOT=0 turns it off
+        if os.environ.get('EXXO_SNAPSHOT') == '0':
+            return None
+        index = self.startup_index
+        if index is None:
+            return None
+        entry = index.lookup(_exxo_index.SNAPSHOT_NAME)
+        if entry is None:
+            return None
+        try:
+            import _exxo_snapshot
+        except ImportError:
+            # for unit tests
+            from . import _exxo_snapshot
+        return _exxo_snapshot.install(self.executable, index.read(entry))
+
+    def readahead(self):
+        # members used at startup were put in one region by exxo build
+        # --layout-from. let the kernel read it in one go instead of
+        # faulting scattered small reads
+        fadvise = getattr(os, 'posix_fadvise', None)
+        if fadvise is None:
+            return
+        index = self.startup_index
+        if index is None or not index.hot_size:
+            return
+        fd = os.open(self.executable, os.O_RDONLY)
+        try:
+            fadvise(fd, index.hot_start, index.hot_size, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def start_prefetch(self):
+        # EXXO_PREFETCH=1: extract extension modules listed at build
+        # time (exxo build --prefetch) on a background thread, so that
+        # it overlaps with loading of python modules
+        if os.environ.get('EXXO_PREFETCH', '0') in ('', '0') or self.extract_mode == 'memfd':
+            return
+        if self.exe_index is None or not self.has_member(_exxo_index.PREFETCH_NAME):
+            return
+        with self.open_member(_exxo_index.PREFETCH_NAME) as fp:
+            paths = [p for p in fp.read().decode('utf-8').splitlines() if self.has_member(p)]
+        # everything the thread needs is set up here: with python 2 it
+        # must not import anything, import lock may be held by the main
+        # thread waiting for a job in load_module
+        if not paths or self.solibs is None:
+            return
+        cache = self.cache
+        try:
+            import _thread as thread
+        except ImportError:
+            import thread
+        import atexit
+        import tempfile
+        jobs = []
+        for path in paths:
+            job = PrefetchJob(path, None if cache is not None else tempfile.mkdtemp())
+            job.lock = thread.allocate_lock()
+            job.lock.acquire()
+            self._prefetch_jobs[path] = job
+            jobs.append(job)
+        atexit.register(self._stop_prefetch)
+        thread.start_new_thread(self._prefetch, (jobs,))
+
+    def _prefetch(self, jobs):
+        for job in jobs:
+            try:
+                if not self._prefetch_cancelled:
+                    job.so_path = self._extract(job.path, job.tmpdir)
+            except Exception:
+                # load_module extracts it again and reports the error
                 pass
+            finally:
+                job.lock.release()
+
+    def _stop_prefetch(self):
+        # remove extracted files of modules that were never imported
+        self._prefetch_cancelled = True
+        import shutil
+        for path in list(self._prefetch_jobs):
+            # load_module may have taken it in the meantime
+            job = self._prefetch_jobs.pop(path, None)
+            if job is None:
+                continue
+            job.lock.acquire()
+            if job.tmpdir is not None:
+                shutil.rmtree(job.tmpdir, ignore_errors=True)
+
+    def _memfd_path(self, src):
+        fd = memfd_create(os.path.basename(src))
+        self._memfds.append(fd)
+        import io
+        with io.open(fd, 'wb', closefd=False) as fp:
+            self._extract_to(src, fp)
+        return '/proc/self/fd/{0}'.format(fd)
+
+    def _load_from_memory(self, fullname, path, spec):
+        # returns None if memory files can't be used, so that caller
+        # falls back to extraction
+        if not os.path.isdir('/proc/self/fd'):
+            return None
+        first = len(self._memfds)
+        try:
+            so_path = self._memfd_path(path)
+            solibs = self.solibs
+            if solibs is not None:
+                deps = [self._memfd_path(dep) for dep in solibs.get(path, [])]
+            else:
+                deps = []
+                self._memfd_deps(path, so_path, None, deps)
+            import ctypes
+            # dependencies go first. the dynamic linker then finds them
+            # among loaded libraries by their soname
+            for dep in deps:
+                self._memfd_handles.append(ctypes.CDLL(dep, mode=RTLD_NOW | RTLD_GLOBAL))
+            return self._load_extension(fullname, so_path, spec)
+        except (OSError, ImportError):
+            # noexec memory files, a dependency the soname lookup
+            # misses...
+            self._close_memfds(first)
+            return None
+
+    def _close_memfds(self, first):
+        # memory files of a failed load, from index first on. the ones
+        # the dynamic linker has loaded stay open (see __init__)
+        import ctypes
+        keep = []
+        for fd in self._memfds[first:]:
+            try:
+                ctypes.CDLL('/proc/self/fd/{0}'.format(fd), mode=RTLD_NOW | RTLD_NOLOAD)
+            except OSError:
+                os.close(fd)
+            else:
+                keep.append(fd)
+        self._memfds[first:] = keep
+
+    def _memfd_deps(self, zip_path, so_path, cur_rpath, deps):
+        # put bundled dependencies of a solib into memory files, deepest
+        # first
+        try:
+            import _exxo_elf
+        except ImportError:
+            # for unit tests
+            from . import _exxo_elf
+        elf = _exxo_elf.readelf(so_path)
+        dyntab = elf['dynamic']
+        rpath = elf['rpath'].decode() if elf['rpath'] else cur_rpath
+        if rpath is None:
+            return
+        rpath = resolve_rpath(rpath, zip_path)
+        for lib in dyntab.get(_exxo_elf.DT_NEEDED, []):
+            path = self._find_needed(rpath, lib.decode())
+            if path is not None:
+                dep = self._memfd_path(path)
+                self._memfd_deps(path, dep, rpath, deps)
+                deps.append(dep)
+
+    def _find_needed(self, rpath, lib):
+        # archive member of a DT_NEEDED library, searched in RPATH entries
+        # in order like the dynamic linker does. None if not bundled
+        for entry in rpath.split(':'):
+            path = os.path.normpath('{0}/{1}'.format(entry, lib))
+            if self.has_member(path):
+                return path
+        return None
+
+    def _extract_with_deps(self, path, dst_dir):
+        so_path = os.path.join(dst_dir, os.path.basename(path))
+        self._extract_so_file(path, so_path)
+        solibs = self.solibs
+        if solibs is None:
+            self._handle_rpath(path, so_path)
+            return so_path
+        # stored with RPATH already pointing to $ORIGIN
+        for dep in solibs.get(path, []):
+            self._extract_so_file(dep, os.path.join(dst_dir, os.path.basename(dep)))
+        return so_path
+
+    def _load_extension(self, fullname, so_path, spec):
+        if sys.version_info[0] == 2:
+            import imp
+            name = fullname.split('.')[-1]
+            mod = imp.load_dynamic(name, so_path)
+        else:
+            from importlib.machinery import ExtensionFileLoader
+            loader = ExtensionFileLoader(fullname, so_path)
+            spec.origin = so_path
+            mod = loader.create_module(spec)
+        sys.modules[fullname] = mod
+        return mod
+
+    def _stored_range(self, src):
+        # (data offset, size) of a stored member or None
+        if self.exe_index is not None:
+            entry = self.exe_index.lookup(src)
+            if entry.flags & _exxo_index.FLAG_DEFLATED:
+                return None
+            return entry.offset, entry.size
+        import struct
+        import zipfile
+        info = self.exe_zip.getinfo(src)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        header_size = struct.calcsize(LOCAL_HEADER)
+        with open(self.executable, 'rb') as exe:
+            exe.seek(info.header_offset)
+            header = struct.unpack(LOCAL_HEADER, exe.read(header_size))
+        name_len, extra_len = header[-2:]
+        return info.header_offset + header_size + name_len + extra_len, info.file_size
 
     def _extract_so_file(self, src, dst):
-        with self.exe_zip.open(src) as src:
-            with open(dst, 'wb') as dst:
-                shutil.copyfileobj(src, dst)
-                os.fchmod(dst.fileno(), 0o700)
+        with open(dst, 'wb') as dstfp:
+            os.fchmod(dstfp.fileno(), 0o700)
+            self._extract_to(src, dstfp)
+
+    def _extract_to(self, src, dstfp):
+        if self.tracer is not None:
+            self.tracer.record(src)
+        stored = self._stored_range(src)
+        if stored is not None and self._copy_stored(stored, dstfp):
+            return
+        if self.exe_index is not None:
+            # no imports on this path, see start_prefetch
+            dstfp.write(self.exe_index.read(self.exe_index.lookup(src)))
+            return
+        import shutil
+        with self.open_member(src) as srcfp:
+            shutil.copyfileobj(srcfp, dstfp)
+
+    def _copy_stored(self, stored, dstfp):
+        # stored members are copied straight from the executable
+        offset, size = stored
+        with open(self.executable, 'rb') as exe:
+            if copy_range(exe.fileno(), dstfp.fileno(), offset, size):
+                return True
+        # start over and let python copy the data
+        os.lseek(dstfp.fileno(), 0, os.SEEK_SET)
+        os.ftruncate(dstfp.fileno(), 0)
+        return False
 
     def _get_path_in_zip(self, fullname):
         path = '{}{}'.format(fullname.replace('.', '/'), self.ext_suffix)
-        return path if path in self.exe_names else None
+        return path if self.has_member(path) else None
 
     def _handle_rpath(self, zip_path, solib_path, cur_rpath=None):
         if sys.platform not in ('linux', 'linux2'):
@@ -86,7 +745,7 @@ class ModuleImporter(object):
         dst_dir = os.path.dirname(solib_path)
         elf = _exxo_elf.readelf(solib_path)
         dyntab = elf['dynamic']
-        rpath = dyntab.get(_exxo_elf.DT_RPATH, [])
+        rpath = elf['rpath']
         if not rpath:
             if cur_rpath is None:
                 return
@@ -95,13 +754,14 @@ class ModuleImporter(object):
             # handling dependecies recursively
             rpath = cur_rpath
         else:
-            rpath = rpath[0].decode()
-            # replace current RPATH with $ORIGIN and copy referenced
+            rpath = rpath.decode()
+            # replace current RPATH (or RUNPATH) with $ORIGIN and copy referenced
             # libraries to the same directory as extension module solib
             new_rpath = '$ORIGIN'
             # TODO: if RPATH is shorter than $ORIGIN all we do is hope
             # RPATH is not needed at all
             if len(rpath) < len(new_rpath):
+                import warnings
                 warnings.warn("can't overwrite RPATH {} with {}".format(rpath, new_rpath))
                 return
             with open(solib_path, 'rb+') as fp:
@@ -109,16 +769,26 @@ class ModuleImporter(object):
                 fp.write(new_rpath.encode() + b'\0')
         # extract dependencies from zip, if any. put them in the same
         # temporary directory
-        origin = os.path.dirname(zip_path)
-        rpath = os.path.normpath(rpath.replace('$ORIGIN', origin))
+        rpath = resolve_rpath(rpath, zip_path)
         for lib in dyntab.get(_exxo_elf.DT_NEEDED, []):
             lib = lib.decode()
-            path = os.path.normpath('{}/{}'.format(rpath, lib))
-            if path in self.exe_names:
+            path = self._find_needed(rpath, lib)
+            if path is not None:
                 dst = os.path.join(dst_dir, lib)
                 self._extract_so_file(path, dst)
                 # extract dependecies recursively
                 self._handle_rpath(path, dst, cur_rpath=rpath)
 
 
+class PrefetchJob(object):
+    __slots__ = ('path', 'tmpdir', 'so_path', 'lock')
+
+    def __init__(self, path, tmpdir):
+        self.path = path
+        self.tmpdir = tmpdir
+        self.so_path = None
+        # held until the extension is extracted (or extraction failed)
+        self.lock = None
+
+
 exxo_importer = ModuleImporter()
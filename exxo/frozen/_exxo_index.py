@@ -0,0 +1,219 @@
+import os
+import mmap
+import zlib
+import struct
+
+
+# archive index written by exxo build as the last archive member, right
+# before the central directory. records are sorted by FNV-1a hash of
+# member name, so lookups are a binary search over the mapped file.
+# every directory points to a range of the children array (record
+# numbers sorted by name):
+#
+#   header | records | children | names | footer
+INDEX_NAME = '__exxo__/index'
+INDEX_MAGIC = b'EXXOIDX1'
+INDEX_VERSION = 3
+# magic, version, record count, build id, root children start, root
+# children count, children array length, offset and size of the hot
+# region (members used at startup, see exxo build --layout-from)
+INDEX_HEADER = struct.Struct('<8sII16sIIIII')
+# name hash, name offset, name length, flags, data offset, compressed
+# size, size, crc, mode, mtime, children start, children count
+INDEX_RECORD = struct.Struct('<QIHHIIIIIIII')
+INDEX_FOOTER = struct.Struct('<8sI')
+HASH = struct.Struct('<Q')
+CHILD = struct.Struct('<I')
+END_RECORD = struct.Struct('<4s4H2LH')
+END_MAGIC = b'PK\005\006'
+
+FLAG_DIR = 1
+FLAG_DEFLATED = 2
+FLAG_NATIVE = 4
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+HASH_MASK = (1 << 64) - 1
+
+
+DIR_MODE = 0o40755
+
+# bundled solib dependencies of shared libraries, in load order, one
+# library per line: library, tab separated dependencies
+SOLIBS_NAME = '__exxo__/solibs'
+# extension modules to extract in background at startup, one per line
+PREFETCH_NAME = '__exxo__/prefetch'
+# code objects of modules imported at startup, see _exxo_snapshot
+SNAPSHOT_NAME = '__exxo__/snapshot'
+# restart points of large deflated members, one member per line:
+# member, tab separated offset:compressed offset pairs
+CHECKPOINTS_NAME = '__exxo__/checkpoints'
+
+
+class Entry(object):
+    # plain class rather than namedtuple: importing collections at
+    # startup isn't free
+    __slots__ = ('name', 'flags', 'offset', 'compress_size', 'size', 'crc', 'mode',
+                 'mtime', 'children_start', 'children_count')
+
+    def __init__(self, *fields):
+        for slot, value in zip(self.__slots__, fields):
+            setattr(self, slot, value)
+
+
+def fnv1a(data):
+    h = FNV_OFFSET
+    for b in bytearray(data):
+        h = ((h ^ b) * FNV_PRIME) & HASH_MASK
+    return h
+
+
+def parent_dir(name):
+    # 'pkg/sub/' -> 'pkg/', 'pkg/mod.py' -> 'pkg/', 'mod.py' -> ''
+    parent = name.rstrip('/').rpartition('/')[0]
+    return parent + '/' if parent else ''
+
+
+def build_index(entries, build_id, hot=(0, 0)):
+    # entries: (name, flags, offset, compress_size, size, crc, mode,
+    # mtime) tuples
+    entries = list(entries)
+    known = set(e[0] for e in entries)
+    mtime = max([e[7] for e in entries] or [0])
+    for e in list(entries):
+        # directories without an archive entry of their own
+        parent = parent_dir(e[0])
+        while parent and parent not in known:
+            known.add(parent)
+            entries.append((parent, FLAG_DIR, 0, 0, 0, 0, DIR_MODE, mtime))
+            parent = parent_dir(parent)
+    keyed = sorted((fnv1a(e[0].encode('utf-8')), e[0].encode('utf-8'), e) for e in entries)
+    positions = dict((e[0], pos) for pos, (_, _, e) in enumerate(keyed))
+    tree = {}
+    for e in sorted(entries):
+        tree.setdefault(parent_dir(e[0]), []).append(positions[e[0]])
+    children = []
+    ranges = {}
+    for dirname in sorted(tree):
+        ranges[dirname] = (len(children), len(tree[dirname]))
+        children.extend(tree[dirname])
+    records = []
+    names = []
+    names_size = 0
+    for h, name, e in keyed:
+        start, count = ranges.get(e[0], (0, 0))
+        records.append(INDEX_RECORD.pack(h, names_size, len(name), *(e[1:] + (start, count))))
+        names.append(name)
+        names_size += len(name)
+    root_start, root_count = ranges.get('', (0, 0))
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(records), build_id,
+                               root_start, root_count, len(children), hot[0], hot[1])
+    body = (header + b''.join(records) +
+            b''.join(CHILD.pack(pos) for pos in children) + b''.join(names))
+    return body + INDEX_FOOTER.pack(INDEX_MAGIC, len(body) + INDEX_FOOTER.size)
+
+
+def dump_solibs(deps):
+    lines = ['\t'.join([name] + deps[name]) + '\n' for name in sorted(deps)]
+    return ''.join(lines).encode('utf-8')
+
+
+def load_solibs(data):
+    deps = {}
+    for line in data.decode('utf-8').splitlines():
+        fields = line.split('\t')
+        deps[fields[0]] = fields[1:]
+    return deps
+
+
+def dump_checkpoints(points):
+    lines = ['\t'.join([name] + ['{0}:{1}'.format(*p) for p in points[name]]) + '\n'
+             for name in sorted(points)]
+    return ''.join(lines).encode('utf-8')
+
+
+def load_checkpoints(data):
+    points = {}
+    for line in data.decode('utf-8').splitlines():
+        fields = line.split('\t')
+        points[fields[0]] = [tuple(int(v) for v in p.split(':')) for p in fields[1:]]
+    return points
+
+
+class ArchiveIndex(object):
+    def __init__(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < END_RECORD.size + INDEX_FOOTER.size:
+                raise ValueError('no archive index in {0}'.format(path))
+            # read-only shared mapping: all processes running the same
+            # executable share these pages
+            self.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        end = END_RECORD.unpack_from(self.mm, size - END_RECORD.size)
+        if end[0] != END_MAGIC:
+            raise ValueError('no archive index in {0}'.format(path))
+        cd_start = size - END_RECORD.size - end[5]
+        magic, length = INDEX_FOOTER.unpack_from(self.mm, cd_start - INDEX_FOOTER.size)
+        if magic != INDEX_MAGIC or length > cd_start:
+            raise ValueError('no archive index in {0}'.format(path))
+        start = cd_start - length
+        magic, version = INDEX_HEADER.unpack_from(self.mm, start)[:2]
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError('unsupported archive index in {0}'.format(path))
+        (_, _, self.count, self.build_id, self.root_start, self.root_count,
+         children_count, self.hot_start, self.hot_size) = INDEX_HEADER.unpack_from(self.mm, start)
+        self.records = start + INDEX_HEADER.size
+        self.children = self.records + self.count * INDEX_RECORD.size
+        self.names = self.children + children_count * CHILD.size
+
+    def _entry(self, pos):
+        rec = INDEX_RECORD.unpack_from(self.mm, self.records + pos * INDEX_RECORD.size)
+        name = self.mm[self.names + rec[1]:self.names + rec[1] + rec[2]]
+        return Entry(name, *rec[3:])
+
+    def lookup(self, name):
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        h = fnv1a(name)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if HASH.unpack_from(self.mm, self.records + mid * INDEX_RECORD.size)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            if HASH.unpack_from(self.mm, self.records + lo * INDEX_RECORD.size)[0] != h:
+                break
+            entry = self._entry(lo)
+            if entry.name == name:
+                return entry
+            lo += 1
+        return None
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def listdir(self, entry=None):
+        # children of given directory entry (or of the archive root)
+        if entry is None:
+            start, count = self.root_start, self.root_count
+        else:
+            start, count = entry.children_start, entry.children_count
+        for i in range(start, start + count):
+            yield self._entry(CHILD.unpack_from(self.mm, self.children + i * CHILD.size)[0])
+
+    def names_iter(self):
+        for pos in range(self.count):
+            yield self._entry(pos).name.decode('utf-8')
+
+    def read(self, entry):
+        data = self.mm[entry.offset:entry.offset + entry.compress_size]
+        if entry.flags & FLAG_DEFLATED:
+            data = zlib.decompress(data, -15)
+        if zlib.crc32(data) & 0xFFFFFFFF != entry.crc:
+            raise IOError('bad CRC-32 for archive member {0!r}'.format(entry.name))
+        return data
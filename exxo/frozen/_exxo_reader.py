@@ -0,0 +1,260 @@
+import io
+import os
+import sys
+import zlib
+import bisect
+from collections import OrderedDict
+try:
+    import _thread as thread
+except ImportError:
+    import thread
+
+
+# file objects returned by open() for paths inside the executable.
+# members are served from the read-only mapping of the archive (or
+# inflated in memory), so every reader has a position of its own: no
+# file offset shared between threads, greenlets or forked workers, and
+# nothing to lock
+
+# open() buffers a member in one go up to MAX_BUFFER_SIZE
+MIN_BUFFER_SIZE = io.DEFAULT_BUFFER_SIZE
+MAX_BUFFER_SIZE = 1024 * 1024
+# compressed bytes fed to the inflater at once
+INFLATE_CHUNK_SIZE = 64 * 1024
+# EXXO_FILE_CACHE_SIZE unit
+CACHE_SIZE_UNIT = 1024 * 1024
+
+
+def buffer_size(size):
+    return max(MIN_BUFFER_SIZE, min(size, MAX_BUFFER_SIZE))
+
+
+class BaseReader(io.RawIOBase):
+    def __init__(self, name, size):
+        io.RawIOBase.__init__(self)
+        self.name = name
+        self.size = size
+        self._pos = 0
+        # read by io.open() when picking buffer size, like FileIO._blksize
+        self._blksize = buffer_size(size)
+
+    def _check(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+    def readable(self):
+        self._check()
+        return True
+
+    def seekable(self):
+        self._check()
+        return True
+
+    def tell(self):
+        self._check()
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        self._check()
+        if whence == io.SEEK_SET:
+            base = 0
+        elif whence == io.SEEK_CUR:
+            base = self._pos
+        elif whence == io.SEEK_END:
+            base = self.size
+        else:
+            raise ValueError('invalid whence ({0!r})'.format(whence))
+        if base + pos < 0:
+            raise ValueError('negative seek position {0!r}'.format(base + pos))
+        self._pos = base + pos
+        return self._pos
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return self.read()
+
+
+class MemberReader(BaseReader):
+    def __init__(self, name, buf, start=0, size=None):
+        if size is None:
+            size = len(buf) - start
+        BaseReader.__init__(self, name, size)
+        self._buf = buf
+        self._start = start
+        # python 2 mmap has no buffer interface, slices are copies there
+        self._view = memoryview(buf) if sys.version_info[0] > 2 else None
+
+    def _slice(self, end):
+        # data from current position to end, advancing the position
+        start = self._start + self._pos
+        self._pos = max(self._pos, min(end, self.size))
+        if self._view is None:
+            return self._buf[start:self._start + self._pos]
+        return self._view[start:self._start + self._pos]
+
+    def readinto(self, b):
+        self._check()
+        data = self._slice(self._pos + len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def read(self, size=-1):
+        self._check()
+        if size is None or size < 0:
+            size = self.size
+        return bytes(self._slice(self._pos + size))
+
+    def readline(self, size=-1):
+        self._check()
+        end = self.size
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        nl = self._buf.find(b'\n', self._start + self._pos, self._start + end)
+        return bytes(self._slice(end if nl == -1 else nl + 1 - self._start))
+
+    def getbuffer(self):
+        # whole member, without a copy where the platform allows it
+        self._check()
+        if self._view is None:
+            return memoryview(self._buf[self._start:self._start + self.size])
+        return self._view[self._start:self._start + self.size]
+
+    def close(self):
+        self._view = None
+        BaseReader.close(self)
+
+
+class InflatingReader(BaseReader):
+    # large deflated member with restart points written by exxo build
+    # (the compressor state is flushed there): a seek inflates from the
+    # closest point before the new position instead of from the start
+    def __init__(self, name, buf, start, compress_size, size, checkpoints):
+        BaseReader.__init__(self, name, size)
+        self._buf = buf
+        self._start = start
+        self._compress_size = compress_size
+        # (offset, compressed offset) of restart points
+        self._points = [(0, 0)] + sorted(checkpoints)
+        self._offsets = [p[0] for p in self._points]
+        self._restart(0)
+
+    def _restart(self, point):
+        # _data is inflated from _out on, input is consumed up to _in
+        self._out, self._in = self._points[point]
+        self._inflater = zlib.decompressobj(-15)
+        self._data = b''
+
+    def _peek(self):
+        # (data, index of current position in data)
+        pos = self._pos
+        if pos >= self.size:
+            return b'', 0
+        point = bisect.bisect_right(self._offsets, pos) - 1
+        if pos < self._out or self._offsets[point] > self._out + len(self._data):
+            self._restart(point)
+        while pos >= self._out + len(self._data):
+            if self._in >= self._compress_size:
+                raise IOError('truncated archive member {0!r}'.format(self.name))
+            self._out += len(self._data)
+            end = min(self._in + INFLATE_CHUNK_SIZE, self._compress_size)
+            self._data = self._inflater.decompress(
+                self._buf[self._start + self._in:self._start + end])
+            self._in = end
+        return self._data, pos - self._out
+
+    def read(self, size=-1):
+        self._check()
+        if size is None or size < 0:
+            size = self.size
+        chunks = []
+        while size > 0:
+            data, i = self._peek()
+            chunk = data[i:i + size]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def readline(self, size=-1):
+        self._check()
+        if size is None or size < 0:
+            size = self.size
+        chunks = []
+        while size > 0:
+            data, i = self._peek()
+            end = min(len(data), i + size)
+            if i >= end:
+                break
+            nl = data.find(b'\n', i, end)
+            if nl != -1:
+                end = nl + 1
+            chunks.append(data[i:end])
+            self._pos += end - i
+            size -= end - i
+            if nl != -1:
+                break
+        return b''.join(chunks)
+
+
+class FileCache(object):
+    # inflated members kept between open() calls (templates, locale
+    # catalogs...), least recently used dropped first once the cache
+    # grows over EXXO_FILE_CACHE_SIZE megabytes. readers share cached
+    # data, nothing is copied on a hit. with a size of 0 the cache is
+    # disabled and its stats stay zero
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        # (data offset, crc) -> member data, oldest first
+        self.entries = OrderedDict()
+        self.lock = thread.allocate_lock()
+        self.hits = self.misses = self.evictions = 0
+
+    @classmethod
+    def create(cls):
+        try:
+            size = int(os.environ.get('EXXO_FILE_CACHE_SIZE', '0'))
+        except ValueError:
+            size = 0
+        return cls(max(size, 0) * CACHE_SIZE_UNIT)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            data = self.entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries[key] = data
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if not self.enabled or len(data) > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'size': self.size,
+                    'max_size': self.max_size}
@@ -0,0 +1,150 @@
+import os
+import sys
+import struct
+import marshal
+import zipimport
+
+
+# code objects of modules imported at startup, written by exxo build
+# --snapshot-from. the member is read in one go and modules are
+# unmarshalled on import, without going through zipimport:
+#
+#   header | entries | names | marshalled code
+SNAPSHOT_MAGIC = b'EXXOSNP1'
+# magic, bytecode magic of the interpreter, entry count
+SNAPSHOT_HEADER = struct.Struct('<8s4sI')
+# flags, name length, code offset, code size
+SNAPSHOT_ENTRY = struct.Struct('<HHII')
+
+FLAG_PACKAGE = 1
+
+
+def dump_snapshot(pyc_magic, modules):
+    # modules: (name, is_package, marshalled code) tuples
+    names = b''.join(name.encode('utf-8') for name, _, _ in modules)
+    offset = SNAPSHOT_HEADER.size + len(modules) * SNAPSHOT_ENTRY.size + len(names)
+    entries = []
+    for name, is_package, code in modules:
+        entries.append(SNAPSHOT_ENTRY.pack(FLAG_PACKAGE if is_package else 0,
+                                           len(name.encode('utf-8')), offset, len(code)))
+        offset += len(code)
+    return (SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, pyc_magic, len(modules)) + b''.join(entries) +
+            names + b''.join(code for _, _, code in modules))
+
+
+def interpreter_magic():
+    bootstrap = sys.modules.get('_frozen_importlib_external')
+    if bootstrap is not None:
+        return bootstrap.MAGIC_NUMBER
+    import imp
+    return imp.get_magic()
+
+
+class SnapshotImporter(object):
+    def __init__(self, archive, data):
+        self.archive = archive
+        self.data = data
+        magic, pyc_magic, count = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('not an exxo snapshot')
+        self.pyc_magic = pyc_magic
+        # name -> (is package, code offset, code size)
+        self.modules = {}
+        pos = SNAPSHOT_HEADER.size + count * SNAPSHOT_ENTRY.size
+        for i in range(count):
+            flags, name_len, offset, size = SNAPSHOT_ENTRY.unpack_from(
+                data, SNAPSHOT_HEADER.size + i * SNAPSHOT_ENTRY.size)
+            name = data[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            self.modules[name] = (bool(flags & FLAG_PACKAGE), offset, size)
+        self._zipimporters = {}
+
+    def _dirname(self, fullname):
+        # directory of module file in the archive
+        parts = fullname.split('.')
+        if not self.modules[fullname][0]:
+            parts.pop()
+        return os.path.join(self.archive, *parts)
+
+    def _zipimporter(self, path):
+        if path not in self._zipimporters:
+            self._zipimporters[path] = zipimport.zipimporter(path)
+        return self._zipimporters[path]
+
+    def _loader(self, fullname):
+        # modules get the same loader zipimport would give them, so that
+        # get_data, get_source and pkg_resources keep working
+        return self._zipimporter(os.path.join(self.archive, *fullname.split('.')[:-1]))
+
+    def get_filename(self, fullname):
+        if self.modules[fullname][0]:
+            return os.path.join(self._dirname(fullname), '__init__.py')
+        return os.path.join(self._dirname(fullname), fullname.rpartition('.')[2] + '.py')
+
+    def is_package(self, fullname):
+        return self.modules[fullname][0]
+
+    def get_code(self, fullname):
+        _, offset, size = self.modules[fullname]
+        return marshal.loads(self.data[offset:offset + size])
+
+    def get_source(self, fullname):
+        return self._loader(fullname).get_source(fullname)
+
+    def get_data(self, path):
+        return self._zipimporter(self.archive).get_data(path)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.modules:
+            return None
+        from importlib.machinery import ModuleSpec
+        is_package = self.modules[fullname][0]
+        spec = ModuleSpec(fullname, self, origin=self.get_filename(fullname),
+                          is_package=is_package)
+        spec.has_location = True
+        if is_package:
+            spec.submodule_search_locations = [self._dirname(fullname)]
+        return spec
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        module.__loader__ = self._loader(module.__name__)
+        exec(self.get_code(module.__name__), module.__dict__)
+
+    def find_module(self, fullname, path=None):
+        return self if fullname in self.modules else None
+
+    def load_module(self, fullname):
+        import imp
+        is_package = self.modules[fullname][0]
+        mod = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        mod.__file__ = self.get_filename(fullname)
+        mod.__loader__ = self._loader(fullname)
+        if is_package:
+            mod.__path__ = [self._dirname(fullname)]
+            mod.__package__ = fullname
+        else:
+            mod.__package__ = fullname.rpartition('.')[0]
+        try:
+            exec(self.get_code(fullname), mod.__dict__)
+        except BaseException:
+            sys.modules.pop(fullname, None)
+            raise
+        return sys.modules[fullname]
+
+
+def install(archive, data):
+    importer = SnapshotImporter(archive, data)
+    if importer.pyc_magic != interpreter_magic():
+        return None
+    # in front of the path based finder (and zipimport hook), after
+    # builtin and frozen modules
+    pos = 0
+    for i, finder in enumerate(sys.meta_path):
+        if getattr(finder, '__name__', None) == 'PathFinder':
+            pos = i
+            break
+    sys.meta_path.insert(pos, importer)
+    return importer
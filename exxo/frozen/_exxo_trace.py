@@ -0,0 +1,87 @@
+import os
+import sys
+import atexit
+import zipimport
+
+
+# EXXO_TRACE_IMPORTS=path records archive members a run reads, in order
+# of first use. the file is input for exxo build --layout-from
+
+
+class ImportTracer(object):
+    def __init__(self, path, importer):
+        self.path = path
+        self.importer = importer
+        self.members = []
+        self.seen = set()
+
+    def record(self, name):
+        if name not in self.seen:
+            self.seen.add(name)
+            self.members.append(name)
+
+    def save(self):
+        with open(self.path, 'w') as fp:
+            fp.write(''.join(name + '\n' for name in self.members))
+
+
+def bytecode_names(dirname, name):
+    # candidates in zipimport search order
+    if sys.version_info[0] == 2:
+        return [dirname + name + ('.pyo' if sys.flags.optimize else '.pyc')]
+    tags = ['', '.opt-1', '.opt-2']
+    level = min(sys.flags.optimize, len(tags) - 1)
+    tag = sys.implementation.cache_tag
+    names = ['{0}__pycache__/{1}.{2}{3}.pyc'.format(dirname, name, tag, tags[(level + i) % 3])
+             for i in range(len(tags))]
+    return names + [dirname + name + '.pyc']
+
+
+class TracingZipImporter(zipimport.zipimporter):
+    tracer = None
+
+    def _member(self, path):
+        return path[len(self.archive) + 1:].replace(os.sep, '/')
+
+    def _record_module(self, fullname):
+        prefix = self.prefix.replace(os.sep, '/')
+        subname = fullname.rpartition('.')[2]
+        if self.is_package(fullname):
+            dirname, name = prefix + subname + '/', '__init__'
+        else:
+            dirname, name = prefix, subname
+        for member in bytecode_names(dirname, name) + [dirname + name + '.py']:
+            if self.tracer.importer.has_member(member):
+                self.tracer.record(member)
+                break
+
+    def load_module(self, fullname):
+        self._record_module(fullname)
+        return zipimport.zipimporter.load_module(self, fullname)
+
+    def get_code(self, fullname):
+        self._record_module(fullname)
+        return zipimport.zipimporter.get_code(self, fullname)
+
+    def get_data(self, pathname):
+        if pathname.startswith(self.archive + os.sep):
+            self.tracer.record(self._member(pathname))
+        return zipimport.zipimporter.get_data(self, pathname)
+
+
+def install(importer, path):
+    tracer = ImportTracer(path, importer)
+    TracingZipImporter.tracer = tracer
+    importer.tracer = tracer
+    hooks = sys.path_hooks
+    if zipimport.zipimporter in hooks:
+        hooks[hooks.index(zipimport.zipimporter)] = TracingZipImporter
+    else:
+        hooks.insert(0, TracingZipImporter)
+    # finders created before we got here (at least one for the
+    # executable itself)
+    for entry, finder in list(sys.path_importer_cache.items()):
+        if type(finder) is zipimport.zipimporter:
+            sys.path_importer_cache[entry] = TracingZipImporter(entry)
+    atexit.register(tracer.save)
+    return tracer
@@ -0,0 +1,212 @@
+import re
+import ast
+
+
+MODULE_SUFFIXES = ('.py', '.pyc', '.pyo')
+SOURCE_SUFFIX = '.py'
+
+# fallback for sources the builder's python can't parse (python 2 code)
+IMPORT_RE = re.compile(r'^\s*(?:from\s+(\.*[\w.]*)\s+import\s+\(?([\w\s,*]+)|import\s+([\w.,\s]+))',
+                       re.MULTILINE)
+DYNAMIC_IMPORT_RE = re.compile(r'''(?:__import__|import_module)\(\s*['"]([\w.]+)['"]''')
+
+
+def module_name(arcname):
+    # map archive path to a (module name, is_package) tuple or None, if
+    # the path doesn't belong to an importable python module
+    if arcname.endswith('/'):
+        return None
+    parts = arcname.split('/')
+    fn = parts.pop()
+    if not fn.endswith(MODULE_SUFFIXES):
+        return None
+    if parts and parts[-1] == '__pycache__':
+        # pkg/__pycache__/mod.cpython-35.pyc
+        parts.pop()
+        stem = fn.split('.', 1)[0]
+    else:
+        stem = fn.rsplit('.', 1)[0]
+    if not all(p.isidentifier() for p in parts + [stem]):
+        return None
+    if stem == '__init__':
+        return '.'.join(parts), True
+    return '.'.join(parts + [stem]), False
+
+
+class Module:
+    def __init__(self, name):
+        self.name = name
+        self.is_package = False
+        self.source = None
+
+
+def resolve_relative(package, level, name):
+    if not level:
+        return name
+    base = package.split('.')
+    if level > 1:
+        base = base[:-(level - 1)]
+    if name:
+        base.append(name)
+    return '.'.join(base)
+
+
+class ImportScanner(ast.NodeVisitor):
+    def __init__(self, package):
+        self.package = package
+        self.imports = []
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append((alias.name, ()))
+
+    def visit_ImportFrom(self, node):
+        base = resolve_relative(self.package, node.level, node.module)
+        self.imports.append((base, [a.name for a in node.names if a.name != '*']))
+
+    def visit_Call(self, node):
+        # __import__('x') and importlib.import_module('x') with literal names
+        func = node.func
+        name = getattr(func, 'id', None) or getattr(func, 'attr', None)
+        if name in ('__import__', 'import_module') and node.args:
+            arg = node.args[0]
+            value = getattr(arg, 'value', getattr(arg, 's', None))
+            if isinstance(value, str):
+                self.imports.append((value, ()))
+        self.generic_visit(node)
+
+
+def scan_imports(source, package):
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return scan_imports_fallback(source.decode('utf-8', 'replace'), package)
+    scanner = ImportScanner(package)
+    scanner.visit(tree)
+    return scanner.imports
+
+
+def scan_imports_fallback(source, package):
+    imports = []
+    for m in IMPORT_RE.finditer(source):
+        from_mod, names, modules = m.groups()
+        if modules:
+            for name in modules.split(','):
+                name = name.strip().split()[0] if name.strip() else ''
+                if name:
+                    imports.append((name, ()))
+        else:
+            level = len(from_mod) - len(from_mod.lstrip('.'))
+            base = resolve_relative(package, level, from_mod.lstrip('.'))
+            imports.append((base, [n.strip() for n in names.split(',')
+                                   if n.strip() and n.strip() != '*']))
+    for m in DYNAMIC_IMPORT_RE.finditer(source):
+        imports.append((m.group(1), ()))
+    return imports
+
+
+class Pruner:
+    def __init__(self, entry_modules, keep=(), record=None):
+        self.roots = list(entry_modules)
+        self.keep = list(keep)
+        if record is not None:
+            with open(str(record)) as fp:
+                self.roots.extend(line.strip() for line in fp if line.strip())
+        self.stats = {'kept': 0, 'dropped': 0}
+
+    def _collect(self, entries):
+        modules = {}
+        packages = set()
+        for arcname, path in entries:
+            res = module_name(arcname)
+            if res is None:
+                continue
+            name, is_package = res
+            if not name:
+                continue
+            mod = modules.get(name)
+            if mod is None:
+                mod = modules[name] = Module(name)
+            if is_package:
+                mod.is_package = True
+                packages.add(name.replace('.', '/') + '/')
+            if arcname.endswith(SOURCE_SUFFIX):
+                mod.source = path
+        return modules, packages
+
+    def reachable(self, modules):
+        seen = set()
+        todo = []
+
+        def add(name):
+            # importing a.b.c imports a and a.b too
+            parts = name.split('.')
+            for i in range(1, len(parts) + 1):
+                sub = '.'.join(parts[:i])
+                if sub in modules and sub not in seen:
+                    seen.add(sub)
+                    todo.append(sub)
+
+        for name in self.roots:
+            add(name)
+        for name in modules:
+            if any(name == k or name.startswith(k + '.') for k in self.keep):
+                add(name)
+        while todo:
+            mod = modules[todo.pop()]
+            package = mod.name if mod.is_package else mod.name.rpartition('.')[0]
+            if mod.source is None:
+                # bytecode only: imports are unknown, keep the whole package
+                for name in modules:
+                    if package and name.startswith(package + '.'):
+                        add(name)
+                continue
+            for name, fromlist in scan_imports(mod.source.read_bytes(), package):
+                if not name:
+                    continue
+                add(name)
+                if package and '.' not in name:
+                    # python 2 implicit relative import
+                    add(package + '.' + name)
+                for sub in fromlist:
+                    add(name + '.' + sub)
+        return seen
+
+    def filter(self, entries):
+        modules, packages = self._collect(entries)
+        reachable = self.reachable(modules)
+        kept_packages = {name.replace('.', '/') + '/' for name in reachable
+                         if modules[name].is_package}
+        result = []
+        for arcname, path in entries:
+            if arcname.endswith('/'):
+                result.append((arcname, path))
+                continue
+            res = module_name(arcname)
+            if res is not None and res[0]:
+                keep = res[0] in reachable
+            else:
+                # data files go along with the innermost package they
+                # live in. everything outside packages (dist-info,
+                # top level solibs, etc.) is kept
+                keep = True
+                parts = arcname.split('/')[:-1]
+                for i in range(len(parts), 0, -1):
+                    owner = '/'.join(parts[:i]) + '/'
+                    if owner in packages:
+                        keep = owner in kept_packages
+                        break
+            if keep:
+                result.append((arcname, path))
+            else:
+                self.stats['dropped'] += 1
+        # drop directories that ended up empty
+        used = set()
+        for arcname, _ in result:
+            if not arcname.endswith('/'):
+                parts = arcname.split('/')[:-1]
+                for i in range(1, len(parts) + 1):
+                    used.add('/'.join(parts[:i]) + '/')
+        result = [(a, p) for a, p in result if not a.endswith('/') or a in used]
+        self.stats['kept'] = sum(1 for a, _ in result if not a.endswith('/'))
+        return result
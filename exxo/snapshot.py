@@ -0,0 +1,77 @@
+from .bytecode import bytecode_name
+from .frozen._exxo_snapshot import dump_snapshot
+
+
+BYTECODE_SUFFIXES = ('.pyc', '.pyo')
+
+
+def source_base(line):
+    # 'pkg/__pycache__/mod.cpython-35.pyc', 'pkg/mod.pyc', 'pkg/mod.py'
+    # or 'pkg.mod' -> 'pkg/mod'. None for other archive members
+    if line.endswith(BYTECODE_SUFFIXES):
+        dirname, _, fn = line.rpartition('/')
+        if dirname == '__pycache__' or dirname.endswith('/__pycache__'):
+            dirname = dirname[:-len('__pycache__')].rstrip('/')
+            fn = fn.split('.', 1)[0] + '.pyc'
+        line = (dirname + '/' if dirname else '') + fn
+        return line.rsplit('.', 1)[0]
+    if line.endswith('.py'):
+        return line[:-3]
+    if '/' in line:
+        return None
+    return line.replace('.', '/')
+
+
+class SnapshotBuilder:
+    # marshalled code of modules imported at startup, taken from an
+    # EXXO_TRACE_IMPORTS trace or a list of module names
+    def __init__(self, names, py_version, optimize=0):
+        self.names = list(names)
+        self.py_version = py_version
+        self.optimize = optimize
+        # bytecode header: magic and mtime, plus source size since 3.3
+        # and flags since 3.7
+        version = tuple(int(v) for v in py_version.split('.')[:2])
+        self.header_size = 8 if version < (3, 3) else 12 if version < (3, 7) else 16
+        self.stats = {'modules': 0}
+
+    def _bytecode(self, base, paths):
+        # (module name, is package, bytecode path). packages go first,
+        # like in zipimport
+        if base.endswith('/__init__'):
+            base = base[:-len('/__init__')]
+            candidates = [(True, base + '/__init__.py')]
+        else:
+            candidates = [(True, base + '/__init__.py'), (False, base + '.py')]
+        for is_package, source in candidates:
+            path = paths.get(bytecode_name(source, self.py_version, self.optimize))
+            if path is not None:
+                return base.replace('/', '.'), is_package, path
+        return None, None, None
+
+    def build(self, members):
+        # members: (Member, path) of the archive. returns None if none
+        # of the modules has bytecode in there
+        paths = {m.name: path for m, path in members if not m.is_dir}
+        modules = []
+        seen = set()
+        magic = None
+        for line in self.names:
+            base = source_base(line)
+            if base is None:
+                continue
+            name, is_package, path = self._bytecode(base, paths)
+            if path is None or name in seen:
+                continue
+            seen.add(name)
+            with open(str(path), 'rb') as fp:
+                data = fp.read()
+            if magic is None:
+                magic = data[:4]
+            elif data[:4] != magic:
+                continue
+            modules.append((name, is_package, data[self.header_size:]))
+        self.stats['modules'] = len(modules)
+        if not modules:
+            return None
+        return dump_snapshot(magic, modules)
@@ -0,0 +1,94 @@
+import sys
+import struct
+import posixpath
+from .frozen._exxo_elf import readelf, DT_NEEDED
+
+
+# bundled solibs are extracted flat to one directory at runtime, so
+# their RPATH (or RUNPATH) is rewritten to $ORIGIN in the stored bytes.
+# the new value has to fit into the old string
+ORIGIN = b'$ORIGIN'
+
+
+class Solib:
+    __slots__ = ('needed', 'rpath', 'rpath_offset')
+
+    def __init__(self, needed, rpath, rpath_offset):
+        self.needed = needed
+        self.rpath = rpath
+        self.rpath_offset = rpath_offset
+
+
+def read_solib(path):
+    try:
+        elf = readelf(str(path))
+    except (ValueError, struct.error):
+        return None
+    rpath = elf['rpath']
+    return Solib([lib.decode('utf-8', 'replace') for lib in elf['dynamic'].get(DT_NEEDED, [])],
+                 rpath.decode('utf-8', 'replace') if rpath is not None else None,
+                 elf['rpath_offset'])
+
+
+def is_extension(name):
+    # extension module suffixes of every supported python end with .so
+    return name.endswith('.so')
+
+
+def is_shared_library(name):
+    # extension modules and libraries loaded with ctypes
+    fn = posixpath.basename(name)
+    return fn.endswith('.so') or '.so.' in fn
+
+
+class SolibResolver:
+    # resolves DT_NEEDED of bundled shared libraries against archive
+    # members the same way the dynamic linker will after extraction
+    def __init__(self, solibs):
+        # {member name: Solib} of every ELF member
+        self.solibs = solibs
+        # members whose rpath gets replaced by $ORIGIN
+        self.rewrite = set()
+
+    def _search_path(self, name, cur_rpath):
+        solib = self.solibs[name]
+        if not solib.rpath:
+            # a dependency without RPATH of its own is searched for in
+            # the path of the library that pulled it in
+            return cur_rpath
+        if len(solib.rpath) < len(ORIGIN):
+            sys.stderr.write("warning: can't overwrite RPATH {0} of {1} with {2}\n"
+                             .format(solib.rpath, name, ORIGIN.decode()))
+            return None
+        self.rewrite.add(name)
+        origin = posixpath.dirname(name) or '.'
+        return [posixpath.normpath(p.replace('$ORIGIN', origin))
+                for p in solib.rpath.split(':') if p]
+
+    def _resolve(self, name, cur_rpath, seen, order):
+        rpath = self._search_path(name, cur_rpath)
+        if not rpath:
+            return
+        for lib in self.solibs[name].needed:
+            for dirname in rpath:
+                path = posixpath.normpath(posixpath.join(dirname, lib))
+                if path in self.solibs:
+                    if path not in seen:
+                        seen.add(path)
+                        self._resolve(path, rpath, seen, order)
+                        # dependencies first: the order of loading
+                        order.append(path)
+                    break
+
+    def resolve(self):
+        # {library: [bundled dependency, ...]} for extension modules and
+        # other shared libraries (ctypes) with any bundled dependencies
+        deps = {}
+        for name in sorted(self.solibs):
+            if not is_shared_library(name):
+                continue
+            order = []
+            self._resolve(name, None, set([name]), order)
+            if order:
+                deps[name] = order
+        return deps
@@ -0,0 +1,119 @@
+import re
+import json
+import shutil
+import hashlib
+import subprocess
+import tempfile
+from pathlib import Path
+from .bootstrap import ensure_dir_exists, user_cache_dir
+from .archive import file_digest
+
+
+STATE_FILE = 'exxo-lock.json'
+NAME_RE = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+
+def normalize_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parse_lock(path):
+    # pip requirements file with pinned versions and (optionally)
+    # --hash options, as generated by pip-compile --generate-hashes
+    with open(str(path)) as fp:
+        content = fp.read().replace('\\\n', ' ')
+    reqs = {}
+    for line in content.splitlines():
+        line = line.split(' #', 1)[0].strip()
+        if not line or line.startswith(('#', '-')):
+            continue
+        m = NAME_RE.match(line)
+        if m is None:
+            raise ValueError('invalid requirement in {}: {}'.format(path, line))
+        # hashes order doesn't matter to pip. the rest (specifiers,
+        # markers) is kept as is, only whitespace is normalized
+        tokens = line.split()
+        hashes = sorted(t for t in tokens if t.startswith('--hash='))
+        rest = [t for t in tokens if not t.startswith('--hash=')]
+        reqs[normalize_name(m.group(1))] = ' '.join(rest + hashes)
+    return reqs
+
+
+def lock_digest(reqs):
+    h = hashlib.sha256()
+    for name in sorted(reqs):
+        h.update(reqs[name].encode() + b'\n')
+    return h.hexdigest()
+
+
+class Wheelhouse:
+    def __init__(self, lock, wheelhouse, envdir, site_packages, pyrun):
+        self.lock = Path(lock)
+        self.pyrun = Path(pyrun)
+        self.wheelhouse = Path(wheelhouse).resolve()
+        self.state_file = Path(envdir) / STATE_FILE
+        self.site_packages = Path(site_packages)
+        self.stats = {'installed': 0, 'removed': 0, 'cached': False}
+
+    def pip_install(self, *args):
+        subprocess.check_call(['pip', 'install', '--no-index', '--no-deps',
+                               '--find-links', str(self.wheelhouse)] + list(args))
+
+    def _load_state(self):
+        try:
+            with self.state_file.open() as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {'digest': None, 'requirements': {}}
+
+    def _save_state(self, digest, reqs):
+        with self.state_file.open('w') as fp:
+            json.dump({'digest': digest, 'requirements': reqs}, fp, sort_keys=True)
+
+    def _restore(self, snapshot):
+        shutil.rmtree(str(self.site_packages))
+        shutil.copytree(str(snapshot), str(self.site_packages), symlinks=True)
+
+    def _snapshot(self, snapshot):
+        tmp = snapshot.with_name(snapshot.name + '.tmp')
+        if tmp.exists():
+            shutil.rmtree(str(tmp))
+        ensure_dir_exists(tmp.parent)
+        shutil.copytree(str(self.site_packages), str(tmp), symlinks=True)
+        tmp.rename(snapshot)
+
+    def _install_changed(self, installed, reqs):
+        removed = sorted(set(installed) - set(reqs))
+        if removed:
+            subprocess.check_call(['pip', 'uninstall', '-y'] + removed)
+        changed = [reqs[name] for name in sorted(reqs) if installed.get(name) != reqs[name]]
+        if changed:
+            with tempfile.NamedTemporaryFile('w', suffix='.txt') as fp:
+                fp.write('\n'.join(changed) + '\n')
+                fp.flush()
+                self.pip_install('-U', '-r', fp.name)
+        self.stats['installed'] = len(changed)
+        self.stats['removed'] = len(removed)
+
+    def snapshot_dir(self, digest):
+        # compiled extensions in there are built for one python version
+        # and ABI, so snapshots are per pyrun binary
+        return user_cache_dir('site-packages', file_digest(self.pyrun)[:16], digest)
+
+    def install(self, project_name, source_path):
+        reqs = parse_lock(self.lock)
+        digest = lock_digest(reqs)
+        state = self._load_state()
+        if state['digest'] != digest:
+            snapshot = self.snapshot_dir(digest)
+            if snapshot.exists():
+                self._restore(snapshot)
+                self.stats['cached'] = True
+            else:
+                # keep the project of a previous build out of the snapshot.
+                # not installed on the first build, hence no check
+                subprocess.call(['pip', 'uninstall', '-y', project_name])
+                self._install_changed(state['requirements'], reqs)
+                self._snapshot(snapshot)
+            self._save_state(digest, reqs)
+        self.pip_install('-U', source_path)
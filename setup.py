@@ -20,7 +20,7 @@ setup(
     author="Marcin Bachry",
     author_email='hegel666@gmail.com',
     url='https://github.com/mbachry/exxo',
-    packages=['exxo'],
+    packages=['exxo', 'exxo.frozen'],
     package_dir={'exxo': 'exxo'},
     include_package_data=True,
     install_requires=requirements,
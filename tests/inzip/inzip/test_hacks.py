@@ -2,6 +2,8 @@ import os
 import sys
 import stat
 import io
+import time
+import zipfile
 import inspect
 import ctypes
 import subprocess
@@ -12,6 +14,14 @@ import pytest
 BUNDLED_FILE = os.path.join(os.path.dirname(__file__), 'pkg', 'files', 'foo')
 
 
+def member_mtime(path, suffix=''):
+    # timestamp of the archive member (zip timestamps have 2 seconds
+    # resolution, the index keeps exact ones)
+    with zipfile.ZipFile(sys.executable) as zf:
+        info = zf.getinfo(path[len(sys.executable):].lstrip('/') + suffix)
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
 def test_bundled_file_open():
     with open(BUNDLED_FILE, 'rb') as fp:
         buf = fp.read().strip()
@@ -31,7 +41,7 @@ def test_bundled_file_stat():
     st = os.stat(BUNDLED_FILE)
     assert st.st_size == 4
     assert stat.S_ISREG(st.st_mode)
-    assert int(st.st_mtime) == int(os.stat(sys.executable).st_mtime)
+    assert abs(st.st_mtime - member_mtime(BUNDLED_FILE)) <= 2
     assert os.path.exists(BUNDLED_FILE)
     assert os.path.isfile(BUNDLED_FILE)
 
@@ -40,7 +50,7 @@ def test_bundled_dir_stat():
     d = os.path.dirname(BUNDLED_FILE)
     st = os.stat(d)
     assert stat.S_ISDIR(st.st_mode)
-    assert int(st.st_mtime) == int(os.stat(sys.executable).st_mtime)
+    assert abs(st.st_mtime - member_mtime(d, '/')) <= 2
     assert os.path.exists(d)
     assert os.path.isdir(d)
 
@@ -71,7 +81,6 @@ def test_subprocess_from_bundled_exe():
     subprocess.check_call([exe])
 
 
-@pytest.mark.xfail(reason='broken for now')
 def test_subprocess_output_from_bundled_exe():
     exe = os.path.join(os.path.dirname(__file__), 'spam')
     buf = subprocess.check_output([exe]).decode().strip()
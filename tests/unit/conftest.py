@@ -14,6 +14,9 @@ sys.path.insert(0, str(base_dir))
 
 from exxo.frozen._exxo_importer import ModuleImporter
 
+# SO is gone since python 3.10
+EXT_SUFFIX = sysconfig.get_config_var('EXT_SUFFIX') or sysconfig.get_config_var('SO')
+
 
 def test_zipimport_hook(testdir, tmpdir):
     """Test package loader is being used correctly (see #1837)."""
@@ -41,8 +44,8 @@ def zip_app():
     subprocess.check_call(['python', 'setup.py', 'build_ext', '--inplace'],
                           cwd=str(testdir / 'testapp'))
     tmpdir = tempfile.mkdtemp()
-    sofile = 'spam{}'.format(sysconfig.get_config_var('SO'))
-    rpath_sofile = 'rpath{}'.format(sysconfig.get_config_var('SO'))
+    sofile = 'spam{}'.format(EXT_SUFFIX)
+    rpath_sofile = 'rpath{}'.format(EXT_SUFFIX)
     shutil.copy(str(testdir / 'inzip' / 'inzip' / 'pkg' / sofile), tmpdir)
     # arrange rpath extension so its solib dependency sits in a
     # directory below it (as defined in RPATH)
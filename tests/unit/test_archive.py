@@ -0,0 +1,162 @@
+import zlib
+import zipfile
+import subprocess
+import sys
+import pytest
+
+from exxo.archive import ArchiveBuilder, CompressionPolicy, deflate_checkpoints
+from exxo.frozen._exxo_index import CHECKPOINTS_NAME, load_checkpoints
+
+
+@pytest.fixture
+def source(tmpdir):
+    src = tmpdir.join('src')
+    src.join('pkg', '__init__.py').write('def main():\n    print("hello")\n', ensure=True)
+    src.join('pkg', 'files', 'data.txt').write('spam\n' * 1000, ensure=True)
+    return src
+
+
+def build(source, target, manifest, prefix=None, **kwargs):
+    builder = ArchiveBuilder(str(source), main='pkg:main', manifest=str(manifest), **kwargs)
+    builder.build(str(target), prefix=prefix)
+    return builder
+
+
+def test_archive_is_runnable(source, tmpdir):
+    target = tmpdir.join('app.zip')
+    build(source, target, tmpdir.join('manifest'))
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ['pkg/', 'pkg/__init__.py', 'pkg/files/',
+                                 'pkg/files/data.txt', '__main__.py']
+        assert zf.read('pkg/files/data.txt') == b'spam\n' * 1000
+    out = subprocess.check_output([sys.executable, str(target)])
+    assert out.strip() == b'hello'
+
+
+def test_incremental_rebuild_reuses_unchanged_files(source, tmpdir):
+    target = tmpdir.join('app.zip')
+    manifest = tmpdir.join('manifest')
+    build(source, target, manifest)
+    source.join('pkg', 'files', 'data.txt').write('eggs\n')
+    source.join('pkg', 'new.py').write('x = 1\n')
+    builder = build(source, target, manifest)
+    assert builder.stats == {'reused': 1, 'compressed': 2}
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        assert zf.read('pkg/files/data.txt') == b'eggs\n'
+        assert zf.read('pkg/new.py') == b'x = 1\n'
+
+
+def test_clean_rebuild_ignores_manifest(source, tmpdir):
+    target = tmpdir.join('app.zip')
+    manifest = tmpdir.join('manifest')
+    build(source, target, manifest)
+    builder = build(source, target, manifest, incremental=False)
+    assert builder.stats == {'reused': 0, 'compressed': 2}
+
+
+def test_compression_policy():
+    policy = CompressionPolicy.parse('pyc=stored,data=9')
+    assert policy.level('pkg/__pycache__/mod.cpython-35.pyc', 1000) == 0
+    assert policy.level('pkg/model.bin', 10 * 1024 * 1024) == 9
+    assert policy.level('pkg/static/logo.png', 1000) == 0
+    assert policy.level('pkg/mod.py', 1000) == 6
+    with pytest.raises(ValueError):
+        CompressionPolicy.parse('spam=1')
+    with pytest.raises(ValueError):
+        CompressionPolicy.parse('pyc=fast')
+
+
+def test_policy_change_recompresses_files(source, tmpdir):
+    target = tmpdir.join('app.zip')
+    manifest = tmpdir.join('manifest')
+    build(source, target, manifest)
+    builder = build(source, target, manifest, policy=CompressionPolicy(default=0), jobs=1)
+    assert builder.stats == {'reused': 0, 'compressed': 2}
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo('pkg/files/data.txt').compress_type == zipfile.ZIP_STORED
+
+
+def test_native_members_are_stored_and_page_aligned(source, tmpdir):
+    source.join('pkg', 'ext.so').write_binary(b'\x7fELF' + b'\0' * 5000)
+    source.join('pkg', 'tool').write_binary(b'\x7fELF' + b'\1' * 100)
+    source.join('pkg', 'tool').chmod(0o755)
+    target = tmpdir.join('app.zip')
+    build(source, target, tmpdir.join('manifest'))
+    data = target.read_binary()
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        for name in ('pkg/ext.so', 'pkg/tool'):
+            info = zf.getinfo(name)
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert data.index(zf.read(name)) % 4096 == 0
+
+
+def test_archive_is_appended_to_prefix(source, tmpdir):
+    prefix = tmpdir.join('pyrun')
+    prefix.write_binary(b'\x7fELF' + b'\1' * 5000)
+    source.join('pkg', 'ext.so').write_binary(b'\x7fELF' + b'\0' * 5000)
+    target = tmpdir.join('app')
+    manifest = tmpdir.join('manifest')
+    build(source, target, manifest, prefix=str(prefix))
+    source.join('pkg', 'files', 'data.txt').write('eggs\n')
+    builder = build(source, target, manifest, prefix=str(prefix))
+    assert builder.stats == {'reused': 2, 'compressed': 1}
+    data = target.read_binary()
+    assert data.startswith(prefix.read_binary())
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        assert zf.read('pkg/files/data.txt') == b'eggs\n'
+        assert zf.getinfo('pkg/ext.so').header_offset > 5000
+        assert data.index(zf.read('pkg/ext.so')) % 4096 == 0
+
+
+def test_multicall_binary_dispatch(source, tmpdir):
+    source.join('pkg', 'tools.py').write(
+        'import sys\n'
+        'def spam():\n    print("spam " + " ".join(sys.argv[1:]))\n'
+        'def eggs():\n    print("eggs")\n    return 3\n')
+    target = tmpdir.join('app')
+    scripts = {'app': 'pkg:main', 'spam': 'pkg.tools:spam', 'eggs': 'pkg.tools:eggs'}
+    builder = ArchiveBuilder(str(source), main=scripts, default='app',
+                             manifest=str(tmpdir.join('manifest')))
+    builder.build(str(target))
+    with zipfile.ZipFile(str(target)) as zf:
+        assert (b"SCRIPTS = dict([('app', ('pkg', 'main')), ('eggs', ('pkg.tools', 'eggs')), "
+                b"('spam', ('pkg.tools', 'spam'))])") in zf.read('__main__.py')
+    out = subprocess.check_output([sys.executable, str(target)])
+    assert out.strip() == b'hello'
+    out = subprocess.check_output([sys.executable, str(target), 'spam', '-x'])
+    assert out.strip() == b'spam -x'
+    tmpdir.join('spam').mksymlinkto('app')
+    out = subprocess.check_output([sys.executable, str(tmpdir.join('spam')), 'eggs'])
+    assert out.strip() == b'spam eggs'
+    proc = subprocess.run([sys.executable, str(target), 'eggs'], stdout=subprocess.PIPE)
+    assert (proc.returncode, proc.stdout.strip()) == (3, b'eggs')
+
+
+def test_deflate_checkpoints():
+    data = bytes(bytearray(range(256))) * 40 + b'spam' * 3000
+    compressed, points = deflate_checkpoints(data, 6, interval=4000)
+    assert [p[0] for p in points] == [4000, 8000, 12000, 16000, 20000]
+    assert zlib.decompress(compressed, -15) == data
+    for offset, compress_offset in points:
+        d = zlib.decompressobj(-15)
+        assert d.decompress(compressed[compress_offset:]) == data[offset:]
+
+
+def test_checkpoints_survive_rebuild(source, tmpdir, monkeypatch):
+    monkeypatch.setattr('exxo.archive.CHECKPOINT_INTERVAL', 1000)
+    target = tmpdir.join('app.zip')
+    manifest = tmpdir.join('manifest')
+    build(source, target, manifest, index=True, jobs=1)
+    with zipfile.ZipFile(str(target)) as zf:
+        points = load_checkpoints(zf.read(CHECKPOINTS_NAME))
+    assert list(points) == ['pkg/files/data.txt'] and len(points['pkg/files/data.txt']) == 4
+    source.join('pkg', 'new.py').write('x = 1\n')
+    builder = build(source, target, manifest, index=True, jobs=1)
+    assert builder.stats['reused'] > 0
+    with zipfile.ZipFile(str(target)) as zf:
+        assert load_checkpoints(zf.read(CHECKPOINTS_NAME)) == points
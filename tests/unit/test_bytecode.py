@@ -0,0 +1,52 @@
+import os
+import sys
+import marshal
+import importlib.util
+
+from exxo.archive import scan_tree
+from exxo.bytecode import compile_tree, bytecode_name, SourceStripper
+
+
+def test_bytecode_name():
+    assert bytecode_name('pkg/mod.py', '3.5', 0) == 'pkg/__pycache__/mod.cpython-35.pyc'
+    assert bytecode_name('mod.py', '3.5', 2) == '__pycache__/mod.cpython-35.opt-2.pyc'
+    assert bytecode_name('pkg/mod.py', '2.7', 0) == 'pkg/mod.pyc'
+    assert bytecode_name('pkg/mod.py', '2.7', 1) == 'pkg/mod.pyo'
+
+
+def test_compile_and_strip_sources(tmpdir):
+    src = tmpdir.join('src')
+    mod = src.join('pkg', 'mod.py')
+    mod.write('x = 1\n', ensure=True)
+    src.join('pkg', 'broken.py').write('x = = 1\n')
+    assert compile_tree(sys.executable, str(src), optimize=1, jobs=2) == 2
+    cfile = importlib.util.cache_from_source(str(mod), optimization=1)
+    assert tmpdir.join('src', 'pkg', '__pycache__').join(cfile.rsplit('/', 1)[1]).check()
+    py_version = '{}.{}'.format(*sys.version_info)
+    stripper = SourceStripper(py_version, optimize=1)
+    names = [name for name, _ in stripper.filter(scan_tree(str(src)))]
+    assert 'pkg/mod.py' not in names
+    assert 'pkg/broken.py' in names
+    assert stripper.stats == {'stripped': 1}
+
+
+def code_filename(cfile):
+    with open(cfile, 'rb') as fp:
+        fp.seek(16 if sys.version_info >= (3, 7) else 12)
+        return marshal.load(fp).co_filename
+
+
+def test_recompile_on_changed_options(tmpdir):
+    src = tmpdir.join('src')
+    mod = src.join('pkg', 'mod.py')
+    mod.write('x = 1\n', ensure=True)
+    cfile = importlib.util.cache_from_source(str(mod))
+    compile_tree(sys.executable, str(src))
+    assert code_filename(cfile) == str(mod)
+    compile_tree(sys.executable, str(src), deterministic=True)
+    assert code_filename(cfile) == 'pkg/mod.py'
+    mtime = os.stat(cfile).st_mtime_ns
+    compile_tree(sys.executable, str(src), deterministic=True)
+    assert os.stat(cfile).st_mtime_ns == mtime
+    compile_tree(sys.executable, str(src))
+    assert code_filename(cfile) == str(mod)
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import subprocess
+
+from exxo.frozen._exxo_cache import ExtractCache
+
+
+def populate(calls):
+    def func(dst_dir):
+        calls.append(dst_dir)
+        with open(os.path.join(dst_dir, 'spam.so'), 'wb') as fp:
+            fp.write(b'\0' * 1024)
+    return func
+
+
+def test_cache_entry_is_extracted_once(tmpdir, monkeypatch):
+    monkeypatch.setenv('EXXO_CACHE_DIR', str(tmpdir.join('cache')))
+    cache = ExtractCache.create(b'\1' * 16)
+    calls = []
+    path = cache.get('spam-01234567', populate(calls))
+    assert os.path.isfile(os.path.join(path, 'spam.so'))
+    assert cache.get('spam-01234567', populate(calls)) == path
+    assert len(calls) == 1
+    assert sorted(os.listdir(cache.build_dir)) == ['.lock', 'spam-01234567']
+
+
+def test_cache_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('EXXO_CACHE_DIR', raising=False)
+    monkeypatch.delenv('EXXO_CACHE', raising=False)
+    assert ExtractCache.create(b'\1' * 16) is None
+
+
+def test_cache_rejects_shared_directory(tmpdir, monkeypatch):
+    tmpdir.join('cache').ensure(dir=True).chmod(0o777)
+    monkeypatch.setenv('EXXO_CACHE_DIR', str(tmpdir.join('cache')))
+    assert ExtractCache.create(b'\1' * 16) is None
+
+
+def test_garbage_collection(tmpdir, monkeypatch):
+    monkeypatch.setenv('EXXO_CACHE_DIR', str(tmpdir.join('cache')))
+    old = ExtractCache.create(b'\1' * 16)
+    old_entry = old.get('old-00000000', populate([]))
+    stale = old.get('stale-00000000', populate([]))
+    long_ago = time.time() - 100 * 24 * 3600
+    os.utime(stale, (long_ago, long_ago))
+    old.close()
+    monkeypatch.setenv('EXXO_CACHE_MAX_SIZE', '0')
+    cache = ExtractCache.create(b'\2' * 16)
+    new_entry = cache.get('new-00000000', populate([]))
+    assert not os.path.exists(stale)
+    assert not os.path.exists(old_entry)
+    assert os.path.exists(new_entry)
+    assert os.listdir(str(tmpdir.join('cache'))) == [os.path.basename(cache.build_dir)]
+
+
+HOLDER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from exxo.frozen._exxo_cache import ExtractCache
+cache = ExtractCache.create(b'\\1' * 16)
+print(cache.get('held-00000000', lambda d: open(d + '/spam.so', 'w').close()))
+sys.stdout.flush()
+sys.stdin.read()
+"""
+
+
+def test_garbage_collection_skips_builds_in_use(tmpdir, monkeypatch):
+    base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setenv('EXXO_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setenv('EXXO_CACHE_MAX_SIZE', '0')
+    monkeypatch.setenv('EXXO_CACHE_MAX_AGE', '0')
+    proc = subprocess.Popen([sys.executable, '-c', HOLDER, base_dir],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        held = proc.stdout.readline().decode().strip()
+        assert os.path.isdir(held)
+        # another build collecting garbage
+        cache = ExtractCache.create(b'\2' * 16)
+        cache.get('new-00000000', populate([]))
+        assert os.path.isdir(held)
+        # the same build never evicts its own entries
+        same = ExtractCache.create(b'\1' * 16)
+        same.get('other-00000000', populate([]))
+        assert os.path.isdir(held)
+        same.close()
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    cache.collect_garbage()
+    assert not os.path.exists(os.path.dirname(held))
@@ -0,0 +1,80 @@
+import os
+import time
+import struct
+import zipfile
+import pytest
+
+from exxo.archive import ArchiveBuilder, ZIP_EPOCH
+from exxo.delta import DeltaError, create_delta, apply_delta
+
+
+def make_source(src, mtime):
+    src.join('pkg', '__init__.py').write('def main():\n    print("hello")\n', ensure=True)
+    for i in range(20):
+        src.join('pkg', 'mod{}.py'.format(i)).write(
+            ''.join('x{0} = {1}\n'.format(j, os.urandom(8).hex()) for j in range(200)))
+    for dirpath, dirnames, filenames in os.walk(str(src)):
+        for fn in dirnames + filenames:
+            os.utime(os.path.join(dirpath, fn), (mtime, mtime))
+    return src
+
+
+def build(src, target, prefix):
+    builder = ArchiveBuilder(str(src), main='pkg:main', epoch=ZIP_EPOCH)
+    builder.build(str(target), prefix=str(prefix))
+
+
+@pytest.fixture
+def prefix(tmpdir):
+    prefix = tmpdir.join('pyrun')
+    prefix.write_binary(os.urandom(10000))
+    return prefix
+
+
+def test_deterministic_build(tmpdir, prefix):
+    src = make_source(tmpdir.join('a'), 1500000000)
+    tmpdir.join('b').mkdir()
+    src.copy(tmpdir.join('b'))
+    os.utime(str(tmpdir.join('b', 'pkg', 'mod1.py')), (1600000000, 1600000000))
+    tmpdir.join('b', 'pkg', 'mod2.py').chmod(0o600)
+    build(tmpdir.join('a'), tmpdir.join('app1'), prefix)
+    build(tmpdir.join('b'), tmpdir.join('app2'), prefix)
+    assert tmpdir.join('app1').read_binary() == tmpdir.join('app2').read_binary()
+
+
+@pytest.mark.parametrize('epoch', [ZIP_EPOCH, 350092801])
+def test_bytecode_mtime_matches_zip_timestamp(tmpdir, monkeypatch, epoch):
+    # zipimport decodes zip timestamps in local time and drops bytecode
+    # whose header doesn't match the source
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    try:
+        src = tmpdir.join('src')
+        src.join('pkg', '__init__.py').write('def main():\n    pass\n', ensure=True)
+        src.join('pkg', '__init__.pyc').write_binary(b'\0' * 16)
+        target = tmpdir.join('app')
+        builder = ArchiveBuilder(str(src), main='pkg:main', epoch=epoch)
+        builder.build(str(target))
+        with zipfile.ZipFile(str(target)) as zf:
+            source_mtime = time.mktime(zf.getinfo('pkg/__init__.py').date_time + (0, 0, -1))
+            pyc_mtime, = struct.unpack('<I', zf.read('pkg/__init__.pyc')[4:8])
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    assert abs(pyc_mtime - source_mtime) <= 1
+
+
+def test_delta_roundtrip(tmpdir, prefix):
+    src = make_source(tmpdir.join('src'), 1500000000)
+    build(src, tmpdir.join('old'), prefix)
+    src.join('pkg', 'mod3.py').write('x = 1\n')
+    src.join('pkg', 'new.py').write('y = 2\n')
+    build(src, tmpdir.join('new'), prefix)
+    old, new, patch = tmpdir.join('old'), tmpdir.join('new'), tmpdir.join('patch')
+    stats = create_delta(str(old), str(new), str(patch))
+    assert stats['copied'] > stats['inserted']
+    assert patch.size() < new.size() // 4
+    apply_delta(str(old), str(patch), str(tmpdir.join('patched')))
+    assert tmpdir.join('patched').read_binary() == new.read_binary()
+    with pytest.raises(DeltaError):
+        apply_delta(str(new), str(patch), str(tmpdir.join('patched')))
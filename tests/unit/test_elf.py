@@ -0,0 +1,148 @@
+import sys
+import struct
+import zipfile
+from unittest import mock
+
+import pytest
+
+from exxo.archive import ArchiveBuilder
+from exxo.frozen import _exxo_elf
+from exxo.frozen._exxo_elf import readelf, DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH
+from exxo.frozen._exxo_index import SOLIBS_NAME, load_solibs
+from exxo.frozen._exxo_importer import ModuleImporter
+
+
+VADDR = 0x400000
+
+
+def make_elf(path, dynamic, elf_class=_exxo_elf.ELFCLASS64, order='<'):
+    # tiny shared object: ELF header, PT_LOAD + PT_DYNAMIC program
+    # headers, dynamic section and .dynstr. no section headers at all
+    is64 = elf_class == _exxo_elf.ELFCLASS64
+    ehdr = struct.Struct(order + ('HHIQQQIHHHHHH' if is64 else 'HHIIIIIHHHHHH'))
+    phdr = struct.Struct(order + ('IIQQQQQQ' if is64 else 'IIIIIIII'))
+    dyn = struct.Struct(order + ('qQ' if is64 else 'iI'))
+    strtab = b'\0'
+    entries = []
+    for tag, value in dynamic:
+        entries.append((tag, len(strtab)))
+        strtab += value + b'\0'
+    phoff = 16 + ehdr.size
+    dyn_off = phoff + 2 * phdr.size
+    # DT_STRTAB, dynamic entries and DT_NULL
+    str_off = dyn_off + (len(entries) + 2) * dyn.size
+    size = str_off + len(strtab)
+    entries.insert(0, (_exxo_elf.DT_STRTAB, VADDR + str_off))
+    entries.append((_exxo_elf.DT_NULL, 0))
+    ident = b'\x7fELF' + bytes(bytearray([elf_class, 1 if order == '<' else 2, 1])) + b'\0' * 9
+    header = ehdr.pack(3, 62, 1, 0, phoff, 0, 0, 16 + ehdr.size, phdr.size, 2, 0, 0, 0)
+    if is64:
+        load = phdr.pack(_exxo_elf.PT_LOAD, 5, 0, VADDR, VADDR, size, size, 0x1000)
+        dynamic = phdr.pack(_exxo_elf.PT_DYNAMIC, 6, dyn_off, VADDR + dyn_off, VADDR + dyn_off,
+                            str_off - dyn_off, str_off - dyn_off, 8)
+    else:
+        load = phdr.pack(_exxo_elf.PT_LOAD, 0, VADDR, VADDR, size, size, 5, 0x1000)
+        dynamic = phdr.pack(_exxo_elf.PT_DYNAMIC, dyn_off, VADDR + dyn_off, VADDR + dyn_off,
+                            str_off - dyn_off, str_off - dyn_off, 6, 4)
+    data = ident + header + load + dynamic + b''.join(dyn.pack(*e) for e in entries) + strtab
+    assert len(data) == size
+    path.write_binary(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('elf_class,order', [
+    (_exxo_elf.ELFCLASS64, '<'),
+    (_exxo_elf.ELFCLASS32, '<'),
+    (_exxo_elf.ELFCLASS64, '>'),
+])
+def test_readelf(tmpdir, elf_class, order):
+    path = make_elf(tmpdir.join('libspam.so'), [
+        (DT_SONAME, b'libspam.so'),
+        (DT_NEEDED, b'libc.so.6'),
+        (DT_NEEDED, b'libeggs.so.1'),
+        (DT_RPATH, b'/opt/spam/lib'),
+    ], elf_class=elf_class, order=order)
+    elf = readelf(path)
+    assert elf['dynamic'][DT_NEEDED] == [b'libc.so.6', b'libeggs.so.1']
+    assert elf['dynamic'][DT_SONAME] == [b'libspam.so']
+    assert elf['rpath'] == b'/opt/spam/lib'
+    with open(path, 'rb') as fp:
+        fp.seek(elf['rpath_offset'])
+        assert fp.read(len(elf['rpath'])) == elf['rpath']
+
+
+def test_readelf_runpath(tmpdir):
+    # the dynamic linker ignores DT_RPATH if DT_RUNPATH is present
+    path = make_elf(tmpdir.join('libspam.so'), [
+        (DT_RUNPATH, b'$ORIGIN/../spam.libs'),
+        (DT_RPATH, b'/opt/spam/lib'),
+        (DT_NEEDED, b'libeggs.so.1'),
+    ])
+    elf = readelf(path)
+    assert elf['dynamic'][DT_RUNPATH] == [b'$ORIGIN/../spam.libs']
+    assert elf['rpath'] == b'$ORIGIN/../spam.libs'
+    with open(path, 'rb') as fp:
+        fp.seek(elf['rpath_offset'])
+        assert fp.read(len(elf['rpath'])) == elf['rpath']
+
+
+def test_readelf_no_rpath(tmpdir):
+    path = make_elf(tmpdir.join('libspam.so'), [(DT_NEEDED, b'libc.so.6')])
+    elf = readelf(path)
+    assert elf['rpath'] is None
+    assert elf['rpath_offset'] is None
+
+
+def test_readelf_not_elf(tmpdir):
+    path = tmpdir.join('spam.so')
+    path.write_binary(b'#!/bin/sh\n' + b'\0' * 100)
+    with pytest.raises(ValueError):
+        readelf(str(path))
+
+
+def build_solib_app(tmpdir, prefetch=()):
+    src = tmpdir.join('src')
+    src.join('pkg', '__init__.py').write('', ensure=True)
+    src.join('spam.libs').ensure(dir=True)
+    make_elf(src.join('pkg', '_spam.so'), [
+        (DT_NEEDED, b'libeggs.so.1'),
+        (DT_NEEDED, b'libc.so.6'),
+        (DT_RPATH, b'$ORIGIN/../spam.libs'),
+    ])
+    make_elf(src.join('spam.libs', 'libeggs.so.1'), [
+        (DT_NEEDED, b'libham.so.2'),
+        (DT_RUNPATH, b'$ORIGIN'),
+    ])
+    make_elf(src.join('spam.libs', 'libham.so.2'), [(DT_NEEDED, b'libc.so.6')])
+    make_elf(src.join('pkg', '_noop.so'), [(DT_NEEDED, b'libc.so.6')])
+    target = tmpdir.join('app')
+    ArchiveBuilder(str(src), index=True, prefetch=prefetch).build(str(target))
+    return target
+
+
+def test_solibs_manifest(tmpdir):
+    target = build_solib_app(tmpdir)
+    with zipfile.ZipFile(str(target)) as zf:
+        solibs = load_solibs(zf.read(SOLIBS_NAME))
+        ext = zf.read('pkg/_spam.so')
+        eggs = zf.read('spam.libs/libeggs.so.1')
+    assert solibs == {'pkg/_spam.so': ['spam.libs/libham.so.2', 'spam.libs/libeggs.so.1'],
+                      'spam.libs/libeggs.so.1': ['spam.libs/libham.so.2']}
+    # RPATH and RUNPATH are rewritten in stored bytes, source is intact
+    assert b'$ORIGIN\0../spam.libs\0' in ext
+    assert b'$ORIGIN/../spam.libs' in tmpdir.join('src', 'pkg', '_spam.so').read_binary()
+    assert b'$ORIGIN\0' in eggs
+
+
+def test_extract_with_solibs_manifest(tmpdir):
+    target = build_solib_app(tmpdir)
+    dst = tmpdir.join('dst').ensure(dir=True)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+        with mock.patch.object(importer, '_handle_rpath') as handle_rpath:
+            so_path = importer._extract_with_deps('pkg/_spam.so', str(dst))
+    assert not handle_rpath.called
+    assert sorted(dst.listdir()) == [dst.join('_spam.so'), dst.join('libeggs.so.1'),
+                                     dst.join('libham.so.2')]
+    assert readelf(so_path)['rpath'] == b'$ORIGIN'
+    assert readelf(str(dst.join('libeggs.so.1')))['rpath'] == b'$ORIGIN'
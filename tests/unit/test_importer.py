@@ -1,3 +1,24 @@
+import os
+import sys
+import ctypes
+import shutil
+import zipfile
+import subprocess
+from unittest import mock
+from pathlib import Path
+
+import pytest
+
+from exxo.archive import ArchiveBuilder
+from exxo.frozen._exxo_index import PREFETCH_NAME
+from exxo.frozen._exxo_importer import ModuleImporter
+from exxo.frozen._exxo_reader import FileCache
+from .test_index import build_app
+from .test_elf import build_solib_app
+
+base_dir = Path(__file__).resolve().parent.parent.parent
+
+
 def test_find_solib_in_zip(importer):
     spec = importer.find_spec('spam', None)
     assert spec is not None
@@ -16,3 +37,283 @@ def test_import_solib_from_zip(importer):
 def test_import_rpath_solib_from_zip(importer):
     from sub.sub2 import rpath
     assert rpath.spam(2, 6) == 8
+
+
+def test_startup_does_not_open_zipfile(tmpdir, monkeypatch):
+    # plain pyrun without an archive, e.g. a venv interpreter
+    exe = tmpdir.join('pyrun')
+    exe.write_binary(b'\x7fELF' + b'\0' * 100)
+    monkeypatch.setattr(sys, 'executable', str(exe))
+    for name in ('EXXO_TRACE_IMPORTS', 'EXXO_SNAPSHOT', 'EXXO_PREFETCH'):
+        monkeypatch.delenv(name, raising=False)
+    importer = ModuleImporter()
+    with mock.patch('zipfile.is_zipfile') as is_zipfile:
+        importer.startup()
+    assert not is_zipfile.called
+    assert not importer.enabled
+
+
+def test_bundled_executable_in_forked_child(tmpdir, monkeypatch):
+    tmpdir.join('src', 'pkg', 'bin', 'hello').write('#!/bin/sh\necho hello\n', ensure=True)
+    tmpdir.join('src', 'pkg', 'bin', 'hello').chmod(0o755)
+    target = build_app(tmpdir)
+    monkeypatch.delenv('EXXO_CACHE_DIR', raising=False)
+    monkeypatch.delenv('EXXO_CACHE', raising=False)
+    with mock.patch.object(sys, 'executable', str(target)), \
+            mock.patch('atexit.register'):
+        importer = ModuleImporter()
+        with mock.patch.object(importer, '_extract_so_file',
+                               wraps=importer._extract_so_file) as extract:
+            path = importer.executable_path('pkg/bin/hello')
+        # renamed into place
+        assert extract.call_args[0][1].endswith('.tmp')
+        parent_root = importer._private_root
+        # the parent removes its directory at exit
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            child_path = importer.executable_path('pkg/bin/hello')
+        child_root = importer._private_root
+    try:
+        assert child_root != parent_root
+        assert child_path.startswith(child_root) and child_path != path
+        assert subprocess.check_output([child_path]) == b'hello\n'
+    finally:
+        shutil.rmtree(parent_root)
+        shutil.rmtree(child_root)
+
+
+MEMFD_IMPORT = """
+import os
+import sys
+sys.path.insert(0, sys.argv[1])
+sys.executable = sys.argv[2]
+from exxo.frozen._exxo_importer import ModuleImporter
+importer = ModuleImporter()
+if sys.argv[3] == 'fail':
+    # e.g. memory files on a noexec mount
+    load_extension = importer._load_extension
+    def _load_extension(fullname, so_path, spec):
+        if so_path.startswith('/proc/self/fd/'):
+            raise ImportError('failed to map segment from shared object')
+        return load_extension(fullname, so_path, spec)
+    importer._load_extension = _load_extension
+sys.meta_path.append(importer)
+sys.path.append(sys.executable)
+import spam
+from sub.sub2 import rpath
+assert spam.spam(2, 6) == 8 and rpath.spam(2, 6) == 8
+print(spam.__file__.startswith('/proc/self/fd/'), rpath.__file__.startswith('/proc/self/fd/'),
+      len(importer._memfds), len(os.listdir('/proc/self/fd')))
+"""
+
+
+def memfd_import(zip_app, mode):
+    env = dict(os.environ, EXXO_EXTRACT_MODE='memfd')
+    out = subprocess.check_output([sys.executable, '-c', MEMFD_IMPORT, str(base_dir), zip_app, mode],
+                                  env=env)
+    return out.decode().split()
+
+
+def test_import_from_memfd(zip_app):
+    from_memfd, rpath_from_memfd, memfds, _ = memfd_import(zip_app, 'ok')
+    assert (from_memfd, rpath_from_memfd) == ('True', 'True')
+    # spam, rpath and its bundled libspamtypes.so
+    assert memfds == '3'
+
+
+def test_import_from_memfd_falls_back_to_extraction(zip_app):
+    from_memfd, rpath_from_memfd, memfds, fds = memfd_import(zip_app, 'fail')
+    assert (from_memfd, rpath_from_memfd) == ('False', 'False')
+    # libspamtypes.so was loaded before rpath failed, the rest is closed
+    assert memfds == '1'
+    _, _, _, fds_ok = memfd_import(zip_app, 'ok')
+    assert int(fds) == int(fds_ok) - 2
+
+
+def test_prefetch(tmpdir, monkeypatch):
+    target = build_solib_app(tmpdir, prefetch=['pkg', 'pkg._spam', 'pkg._missing'])
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.read(PREFETCH_NAME) == b'pkg/_spam.so\n'
+    monkeypatch.setenv('EXXO_PREFETCH', '1')
+    monkeypatch.delenv('EXXO_CACHE_DIR', raising=False)
+    monkeypatch.delenv('EXXO_CACHE', raising=False)
+    with mock.patch.object(sys, 'executable', str(target)), \
+            mock.patch('atexit.register'):
+        importer = ModuleImporter()
+        importer._ext_suffix = '.so'
+        importer.start_prefetch()
+        job = importer._prefetch_jobs['pkg/_spam.so']
+        # let the thread finish before _extract is mocked out
+        with job.lock:
+            pass
+        loaded = []
+        with mock.patch.object(importer, '_load_extension',
+                               side_effect=lambda name, path, spec: loaded.append(
+                                   sorted(os.listdir(os.path.dirname(path))))), \
+                mock.patch.object(importer, '_extract') as extract:
+            importer.load_module('pkg._spam')
+    assert not extract.called
+    assert loaded == [['_spam.so', 'libeggs.so.1', 'libham.so.2']]
+    assert not os.path.exists(job.tmpdir)
+    assert importer._prefetch_jobs == {}
+
+
+
+def test_stop_prefetch_races_with_load_module(tmpdir, monkeypatch):
+    target = build_solib_app(tmpdir, prefetch=['pkg._spam'])
+    monkeypatch.setenv('EXXO_PREFETCH', '1')
+
+    class Jobs(dict):
+        # load_module pops the job right after _stop_prefetch listed it
+        def __iter__(self):
+            paths = list(dict.__iter__(self))
+            self.clear()
+            return iter(paths)
+
+    with mock.patch.object(sys, 'executable', str(target)), \
+            mock.patch('atexit.register'):
+        importer = ModuleImporter()
+        importer._prefetch_jobs = Jobs()
+        importer.start_prefetch()
+        assert list(importer._prefetch_jobs.keys()) == ['pkg/_spam.so']
+        importer._stop_prefetch()
+    assert importer._prefetch_jobs == {}
+
+def test_prefetch_disabled(tmpdir, monkeypatch):
+    target = build_solib_app(tmpdir, prefetch=['pkg._spam'])
+    monkeypatch.delenv('EXXO_PREFETCH', raising=False)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+        importer.start_prefetch()
+    assert importer._prefetch_jobs == {}
+
+
+def test_file_cache(tmpdir, monkeypatch):
+    target = build_app(tmpdir)
+    monkeypatch.setenv('EXXO_FILE_CACHE_SIZE', '1')
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    with mock.patch.object(importer.exe_index, 'read', wraps=importer.exe_index.read) as read:
+        readers = [importer.open_member('pkg/data.txt') for i in range(3)]
+    assert read.call_count == 1
+    assert [r.read() for r in readers] == [b'spam\n' * 100] * 3
+    assert readers[0].getbuffer().obj is readers[2].getbuffer().obj
+    stats = importer.file_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 500)
+    monkeypatch.delenv('EXXO_FILE_CACHE_SIZE')
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    assert importer.open_member('pkg/data.txt').read() == b'spam\n' * 100
+    assert importer.file_cache.stats()['misses'] == 0
+
+
+def test_file_cache_eviction(monkeypatch):
+    monkeypatch.delenv('EXXO_FILE_CACHE_SIZE', raising=False)
+    disabled = FileCache.create()
+    disabled.put('a', b'aaaa')
+    assert disabled.get('a') is None
+    assert disabled.stats() == {'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0,
+                                'size': 0, 'max_size': 0}
+    cache = FileCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    cache.put('huge', b'x' * 11)
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('huge') is None
+    assert cache.get('c') == b'cccc'
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'evictions': 1, 'entries': 2,
+                             'size': 8, 'max_size': 10}
+
+
+def test_bundled_executable(tmpdir, monkeypatch):
+    tmpdir.join('src', 'pkg', 'bin', 'hello').write('#!/bin/sh\necho hello\n', ensure=True)
+    tmpdir.join('src', 'pkg', 'bin', 'hello').chmod(0o755)
+    target = build_app(tmpdir)
+    for cache_dir in [None, tmpdir.join('cache')]:
+        if cache_dir is None:
+            monkeypatch.delenv('EXXO_CACHE_DIR', raising=False)
+            monkeypatch.delenv('EXXO_CACHE', raising=False)
+        else:
+            monkeypatch.setenv('EXXO_CACHE_DIR', str(cache_dir))
+        with mock.patch.object(sys, 'executable', str(target)), \
+                mock.patch('atexit.register') as register:
+            importer = ModuleImporter()
+            path = importer.executable_path('pkg/bin/hello')
+            with mock.patch.object(importer, '_extract_to') as extract_to:
+                assert importer.executable_path('pkg/bin/hello') == path
+            assert not extract_to.called
+            assert importer.executable_path('pkg/bin/missing') is None
+        assert os.path.basename(path) == 'hello'
+        assert subprocess.check_output([path]) == b'hello\n'
+        if cache_dir is None:
+            func, tmp, pid = register.call_args[0]
+            func(tmp, pid + 1)
+            assert os.path.exists(path)
+            func(tmp, pid)
+            assert not os.path.exists(tmp)
+        else:
+            assert path.startswith(str(cache_dir))
+
+
+def compile_lib(path, source, *args):
+    src = path.new(ext='.c')
+    src.write(source)
+    subprocess.check_call(['gcc', '-shared', '-fPIC', '-o', str(path), str(src)] + list(args))
+    src.remove()
+
+
+@pytest.mark.skipif(not shutil.which('gcc'), reason='needs gcc')
+def test_ctypes_dlopen(tmpdir):
+    src = tmpdir.join('src')
+    compile_lib(src.join('deps', 'libtwice.so.1').ensure(), 'int twice(int a) { return 2 * a; }\n',
+                '-Wl,-soname,libtwice.so.1')
+    compile_lib(src.join('pkg', 'libquad.so.1').ensure(),
+                'int twice(int);\nint quad(int a) { return twice(twice(a)); }\n',
+                '-L' + str(src.join('deps')), '-l:libtwice.so.1', '-Wl,-rpath,$ORIGIN/../deps')
+    target = tmpdir.join('app')
+    ArchiveBuilder(str(src), index=True).build(str(target))
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+        path = str(target.join('pkg', 'libquad.so.1'))
+        handle = importer.dlopen(path, ctypes.RTLD_LOCAL)
+        lib = ctypes.CDLL(path, handle=handle)
+        assert lib.quad(3) == 12
+        with mock.patch.object(importer, '_extract') as extract:
+            assert importer.dlopen(path, ctypes.RTLD_LOCAL) == handle
+            assert importer.dlopen(path, ctypes.RTLD_GLOBAL) is not None
+        assert not extract.called
+        assert importer.dlopen(str(target.join('pkg', 'missing.so')), 0) is None
+        assert importer.dlopen('/usr/lib/libc.so.6', 0) is None
+        assert importer.dlopen(None, 0) is None
+        assert sorted(os.listdir(os.path.dirname(importer._library_paths['pkg/libquad.so.1']))) == \
+            ['libquad.so.1', 'libtwice.so.1']
+
+
+@pytest.mark.skipif(not shutil.which('gcc'), reason='needs gcc')
+def test_ctypes_dlopen_retries_outside_cache(tmpdir, monkeypatch):
+    # a cache directory on a noexec mount: the library is extracted to
+    # the private directory and loaded from there
+    src = tmpdir.join('src')
+    compile_lib(src.join('pkg', 'libtwice.so.1').ensure(), 'int twice(int a) { return 2 * a; }\n')
+    target = tmpdir.join('app')
+    ArchiveBuilder(str(src), index=True).build(str(target))
+    cache_dir = tmpdir.join('cache')
+    monkeypatch.setenv('EXXO_CACHE_DIR', str(cache_dir))
+    import _ctypes
+    real_dlopen = _ctypes.dlopen
+
+    def dlopen(path, mode):
+        if path.startswith(str(cache_dir)):
+            raise OSError('failed to map segment from shared object')
+        return real_dlopen(path, mode)
+
+    with mock.patch.object(sys, 'executable', str(target)), \
+            mock.patch.object(_ctypes, 'dlopen', side_effect=dlopen):
+        importer = ModuleImporter()
+        path = str(target.join('pkg', 'libtwice.so.1'))
+        handle = importer.dlopen(path, ctypes.RTLD_LOCAL)
+    assert ctypes.CDLL(path, handle=handle).twice(4) == 8
+    so_path = importer._library_paths['pkg/libtwice.so.1']
+    assert not so_path.startswith(str(cache_dir))
+    assert so_path.startswith(importer._private_root)
@@ -0,0 +1,218 @@
+import io
+import sys
+import zlib
+import zipfile
+import threading
+from unittest import mock
+
+from exxo.archive import ArchiveBuilder, CompressionPolicy
+from exxo.frozen._exxo_index import ArchiveIndex, INDEX_NAME, FLAG_DIR, FLAG_DEFLATED
+from exxo.frozen._exxo_importer import ModuleImporter
+from exxo.frozen._exxo_reader import InflatingReader
+from exxo.frozen._exxo_trace import ImportTracer, TracingZipImporter
+
+
+def build_app(tmpdir, layout=(), policy=None):
+    src = tmpdir.join('src')
+    src.join('pkg', '__init__.py').write('def main():\n    pass\n', ensure=True)
+    src.join('pkg', 'data.txt').write('spam\n' * 100)
+    for i in range(100):
+        src.join('pkg', 'mod{}.py'.format(i)).write('x = {}\n'.format(i))
+    prefix = tmpdir.join('pyrun')
+    prefix.write_binary(b'\0' * 1000)
+    target = tmpdir.join('app')
+    ArchiveBuilder(str(src), main='pkg:main', index=True, layout=layout, policy=policy).build(
+        str(target), prefix=str(prefix))
+    return target
+
+
+def test_index_lookup(tmpdir):
+    target = build_app(tmpdir)
+    with zipfile.ZipFile(str(target)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist()[-1] == INDEX_NAME
+        names = zf.namelist()[:-1]
+    index = ArchiveIndex(str(target))
+    assert index.count == len(names)
+    assert sorted(index.names_iter()) == sorted(names)
+    entry = index.lookup('pkg/data.txt')
+    assert entry.flags & FLAG_DEFLATED
+    assert entry.size == 500
+    assert index.read(entry) == b'spam\n' * 100
+    assert index.lookup('pkg/').flags & FLAG_DIR
+    assert index.read(index.lookup('pkg/mod42.py')) == b'x = 42\n'
+    assert index.lookup('pkg/missing.py') is None
+    assert 'pkg/mod99.py' in index
+    assert len(index.build_id) == 16
+
+
+def test_importer_uses_index(tmpdir):
+    target = build_app(tmpdir)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    assert importer.exe_index is not None and importer.exe_zip is None
+    assert importer.has_member('pkg/mod1.py')
+    assert not importer.has_member('pkg/mod1.pyc')
+    with importer.open_member('pkg/data.txt') as fp:
+        assert fp.read() == b'spam\n' * 100
+    assert importer.member_stat('pkg/data.txt')[1] == 500
+
+
+def test_index_directory_tree(tmpdir):
+    target = build_app(tmpdir)
+    index = ArchiveIndex(str(target))
+    assert [e.name for e in index.listdir()] == [b'__main__.py', b'pkg/']
+    names = [e.name for e in index.listdir(index.lookup('pkg/'))]
+    assert len(names) == 102
+    assert names[:3] == [b'pkg/__init__.py', b'pkg/data.txt', b'pkg/mod0.py']
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    assert importer.member_listdir('') == [('__main__.py', False), ('pkg', True)]
+    assert ('mod7.py', False) in importer.member_listdir('pkg/')
+    is_dir, size, mode, mtime = importer.member_stat('pkg/data.txt')
+    assert (is_dir, size, oct(mode)) == (False, 500, oct(tmpdir.join('src', 'pkg', 'data.txt').stat().mode))
+    assert importer.member_stat('pkg/')[0]
+
+
+def test_index_adds_missing_directories():
+    from exxo.frozen._exxo_index import build_index
+    data = build_index([('a/b/c.txt', 0, 0, 0, 0, 0, 0o100644, 0)], b'\0' * 16)
+    assert b'a/b/' in data and b'a/' in data
+
+
+def test_listdir_without_index(tmpdir):
+    target = tmpdir.join('app.zip')
+    with zipfile.ZipFile(str(target), 'w') as zf:
+        zf.writestr('pkg/', b'')
+        zf.writestr('pkg/sub/', b'')
+        zf.writestr('pkg/sub/mod.py', b'x = 1\n')
+        zf.writestr('pkg/data.txt', b'spam')
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    assert importer.exe_index is None
+    assert importer.member_listdir('pkg/') == [('data.txt', False), ('sub', True)]
+    assert importer.member_stat('pkg/data.txt')[:2] == (False, 4)
+
+
+def test_member_stat_with_and_without_index(tmpdir):
+    target = build_app(tmpdir)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+        with mock.patch('exxo.frozen._exxo_index.ArchiveIndex', side_effect=ValueError):
+            fallback = ModuleImporter()
+            assert fallback.exe_index is None
+    for name in ('pkg/data.txt', 'pkg/'):
+        is_dir, size, mode, mtime = importer.member_stat(name)
+        assert fallback.member_stat(name)[:3] == (is_dir, size, mode)
+        # zip timestamps have 2 seconds resolution
+        assert abs(fallback.member_stat(name)[3] - mtime) <= 2
+    assert mtime == int(tmpdir.join('src', 'pkg').stat().mtime)
+
+
+def test_hot_layout(tmpdir):
+    layout = ['pkg/mod42.py', '__main__.py', 'pkg/missing.py', 'pkg/data.txt', 'pkg/mod42.py']
+    target = build_app(tmpdir, layout=layout)
+    with zipfile.ZipFile(str(target)) as zf:
+        infos = zf.infolist()
+        assert zf.testzip() is None
+    assert [i.filename for i in infos[:3]] == ['pkg/mod42.py', '__main__.py', 'pkg/data.txt']
+    index = ArchiveIndex(str(target))
+    assert index.hot_start == infos[0].header_offset
+    assert index.hot_start + index.hot_size == infos[3].header_offset
+    assert ArchiveIndex(str(build_app(tmpdir.mkdir('plain')))).hot_size == 0
+
+
+def test_trace_imports(tmpdir):
+    target = build_app(tmpdir)
+    trace = tmpdir.join('trace')
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    importer.tracer = ImportTracer(str(trace), importer)
+    with mock.patch.object(TracingZipImporter, 'tracer', importer.tracer):
+        finder = TracingZipImporter(str(target))
+        finder.get_code('pkg')
+        pkg_finder = TracingZipImporter(str(target.join('pkg')))
+        pkg_finder.get_code('pkg.mod3')
+        finder.get_data(str(target.join('pkg', 'data.txt')))
+        pkg_finder.get_code('pkg.mod3')
+    importer.open_member('__main__.py').close()
+    importer.tracer.save()
+    assert trace.read().splitlines() == ['pkg/__init__.py', 'pkg/mod3.py', 'pkg/data.txt',
+                                         '__main__.py']
+
+
+def test_member_reader(tmpdir):
+    importers = []
+    for policy in [None, CompressionPolicy(default=0)]:
+        target = build_app(tmpdir.mkdir(str(len(importers))), policy=policy)
+        with mock.patch.object(sys, 'executable', str(target)):
+            importers.append(ModuleImporter())
+    deflated, stored = importers
+    assert deflated.exe_index.lookup('pkg/data.txt').flags & FLAG_DEFLATED
+    assert not stored.exe_index.lookup('pkg/data.txt').flags & FLAG_DEFLATED
+    data = b'spam\n' * 100
+    for importer in importers:
+        fp = importer.open_member('pkg/data.txt')
+        assert fp.read(3) == data[:3]
+        assert fp.seek(-2, io.SEEK_END) == len(data) - 2
+        buf = bytearray(10)
+        assert fp.readinto(buf) == 2 and buf[:2] == data[-2:]
+        assert fp.read() == b''
+        fp.seek(0)
+        assert fp.readline() == data.split(b'\n')[0] + b'\n'
+        assert bytes(fp.getbuffer()) == data
+        with io.BufferedReader(fp, fp._blksize) as buffered:
+            buffered.seek(0)
+            assert buffered.read() == data
+        assert fp.closed
+    # stored members are views of the mapped executable
+    assert stored.open_member('pkg/data.txt').getbuffer().obj is stored.exe_index.mm
+
+
+def test_member_reader_positions(tmpdir):
+    # readers don't share a file position
+    target = build_app(tmpdir)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    readers = [importer.open_member('pkg/data.txt') for i in range(4)]
+    chunks = [[] for r in readers]
+
+    def read(i):
+        chunk = readers[i].read(5)
+        while chunk:
+            chunks[i].append(chunk)
+            chunk = readers[i].read(5)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(len(readers))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert chunks == [[b'spam\n'] * 100] * len(readers)
+
+
+def test_seek_in_checkpointed_member(tmpdir, monkeypatch):
+    monkeypatch.setattr('exxo.archive.CHECKPOINT_INTERVAL', 64 * 1024)
+    data = b''.join(b'line %d\n' % i for i in range(100000))
+    tmpdir.join('src', 'pkg', 'big.txt').write_binary(data, ensure=True)
+    target = build_app(tmpdir)
+    with mock.patch.object(sys, 'executable', str(target)):
+        importer = ModuleImporter()
+    assert len(importer.checkpoints['pkg/big.txt']) == len(data) // (64 * 1024)
+    fp = importer.open_member('pkg/big.txt')
+    assert isinstance(fp, InflatingReader)
+    for pos in [len(data) - 10, 500000, 12, 500000, 131072, len(data) + 5]:
+        fp.seek(pos)
+        assert fp.read(100) == data[pos:pos + 100]
+    fp.seek(65530)
+    assert fp.readline() == data[65530:data.index(b'\n', 65530) + 1]
+    fp.seek(0)
+    assert list(fp) == data.splitlines(True)
+    fp.seek(0)
+    fp.read(10)
+    with mock.patch('zlib.decompressobj', wraps=zlib.decompressobj) as decompressobj:
+        fp.seek(len(data) - 3)
+        assert fp.read() == data[-3:]
+    # started from the last restart point
+    assert decompressobj.call_count == 1 and fp._in == fp._compress_size
+    assert fp._out == importer.checkpoints['pkg/big.txt'][-1][0]
@@ -0,0 +1,32 @@
+import os
+import sys
+import subprocess
+import shutil
+import tarfile
+from pathlib import Path
+
+base_dir = Path(__file__).resolve().parent.parent.parent
+
+
+def test_sdist_build_imports(tmpdir):
+    # exxo.exxo imports helpers from exxo.frozen at module level, so the
+    # package has to survive sdist -> build. work on a copy, a stale
+    # egg-info in the checkout would hide missing files
+    src = tmpdir.join('src')
+    shutil.copytree(str(base_dir / 'exxo'), str(src.join('exxo')),
+                    ignore=shutil.ignore_patterns('__pycache__', '*.py[co]', 'pyrun'))
+    for fn in ('setup.py', 'MANIFEST.in', 'README.rst', 'AUTHORS.rst', 'LICENSE'):
+        shutil.copy(str(base_dir / fn), str(src))
+    dist = tmpdir.join('dist')
+    subprocess.check_call([sys.executable, 'setup.py', '-q', 'sdist', '--formats=gztar',
+                           '--dist-dir', str(dist)], cwd=str(src))
+    sdist, = dist.listdir()
+    with tarfile.open(str(sdist)) as tar:
+        tar.extractall(str(tmpdir))
+    srcdir = tmpdir.join(sdist.basename[:-len('.tar.gz')])
+    lib = tmpdir.join('lib')
+    subprocess.check_call([sys.executable, 'setup.py', '-q', 'build', '--build-lib', str(lib)],
+                          cwd=str(srcdir))
+    assert lib.join('exxo', 'frozen', '_exxo_importer.py').check()
+    env = dict(os.environ, PYTHONPATH=str(lib))
+    subprocess.check_call([sys.executable, '-c', 'import exxo.exxo'], cwd=str(tmpdir), env=env)
@@ -0,0 +1,40 @@
+from exxo.archive import scan_tree
+from exxo.prune import Pruner, module_name
+
+
+def test_module_name():
+    assert module_name('pkg/__init__.py') == ('pkg', True)
+    assert module_name('pkg/__pycache__/__init__.cpython-35.pyc') == ('pkg', True)
+    assert module_name('pkg/__pycache__/mod.cpython-35.opt-1.pyc') == ('pkg.mod', False)
+    assert module_name('pkg/mod.pyc') == ('pkg.mod', False)
+    assert module_name('pkg/templates/index.html') is None
+    assert module_name('pkg-1.0.dist-info/RECORD') is None
+
+
+def test_prune_unreachable_modules(tmpdir):
+    src = tmpdir.join('src')
+    src.join('app', '__init__.py').write('', ensure=True)
+    src.join('app', 'main.py').write('from . import views\nimport dep.core\n', ensure=True)
+    src.join('app', 'views.py').write('import importlib\nimportlib.import_module("plugin")\n')
+    src.join('app', 'unused.py').write('import bloat\n')
+    src.join('app', 'templates', 'index.html').write('<html/>', ensure=True)
+    src.join('app', 'tests', '__init__.py').write('', ensure=True)
+    src.join('dep', '__init__.py').write('print "python 2 code"\nimport helper\n', ensure=True)
+    src.join('dep', 'core.py').write('')
+    src.join('dep', 'helper.py').write('')
+    src.join('plugin.py').write('')
+    src.join('bloat', '__init__.py').write('', ensure=True)
+    src.join('bloat', 'data.json').write('{}')
+    src.join('dynamic', '__init__.py').write('', ensure=True)
+    src.join('dynamic', 'backend.py').write('')
+    src.join('dep-1.0.dist-info', 'RECORD').write('', ensure=True)
+    pruner = Pruner(['app.main'], keep=['dynamic'])
+    names = [name for name, _ in pruner.filter(scan_tree(str(src)))]
+    assert sorted(names) == sorted([
+        'app/', 'app/__init__.py', 'app/main.py', 'app/templates/',
+        'app/templates/index.html', 'app/views.py',
+        'dep/', 'dep/__init__.py', 'dep/core.py', 'dep/helper.py',
+        'dep-1.0.dist-info/', 'dep-1.0.dist-info/RECORD',
+        'dynamic/', 'dynamic/__init__.py', 'dynamic/backend.py',
+        'plugin.py',
+    ])
@@ -0,0 +1,69 @@
+import sys
+import zipimport
+import py_compile
+from unittest import mock
+
+import pytest
+
+from exxo.archive import ArchiveBuilder
+from exxo.snapshot import SnapshotBuilder, source_base
+from exxo.frozen._exxo_importer import ModuleImporter
+
+
+PY_VERSION = '{}.{}'.format(*sys.version_info[:2])
+
+
+@pytest.fixture
+def snapshot_app(tmpdir):
+    src = tmpdir.join('src')
+    src.join('snappkg', '__init__.py').write('name = "pkg"\n', ensure=True)
+    src.join('snappkg', 'mod.py').write('x = 42\n')
+    src.join('snappkg', 'other.py').write('y = 1\n')
+    src.join('snappkg', 'data.txt').write('spam')
+    for fn in ('__init__.py', 'mod.py', 'other.py'):
+        py_compile.compile(str(src.join('snappkg', fn)), doraise=True)
+    trace = ['snappkg/__pycache__/__init__.{}.pyc'.format(sys.implementation.cache_tag),
+             'snappkg/data.txt', 'snappkg.mod', 'missing']
+    snapshot = SnapshotBuilder(trace, PY_VERSION)
+    target = tmpdir.join('app')
+    ArchiveBuilder(str(src), index=True, snapshot=snapshot).build(str(target))
+    assert snapshot.stats['modules'] == 2
+    meta_path = list(sys.meta_path)
+    yield target
+    sys.meta_path[:] = meta_path
+    for name in list(sys.modules):
+        if name.startswith('snappkg'):
+            del sys.modules[name]
+
+
+def test_source_base():
+    assert source_base('pkg/__pycache__/mod.cpython-35.pyc') == 'pkg/mod'
+    assert source_base('__pycache__/six.cpython-35.opt-1.pyc') == 'six'
+    assert source_base('pkg/__init__.pyc') == 'pkg/__init__'
+    assert source_base('pkg/mod.py') == 'pkg/mod'
+    assert source_base('pkg.mod') == 'pkg/mod'
+    assert source_base('pkg/data.txt') is None
+
+
+def test_import_from_snapshot(snapshot_app):
+    with mock.patch.object(sys, 'executable', str(snapshot_app)):
+        importer = ModuleImporter()
+        finder = importer.load_snapshot()
+    assert sorted(finder.modules) == ['snappkg', 'snappkg.mod']
+    # the archive isn't on sys.path: modules can only come from the snapshot
+    import snappkg.mod
+    assert snappkg.name == 'pkg' and snappkg.mod.x == 42
+    assert snappkg.mod.__file__ == str(snapshot_app.join('snappkg', 'mod.py'))
+    assert isinstance(snappkg.mod.__loader__, zipimport.zipimporter)
+    assert snappkg.mod.__loader__.get_source('snappkg.mod') == 'x = 42\n'
+    assert finder.get_data(str(snapshot_app.join('snappkg', 'data.txt'))) == b'spam'
+    # not in snapshot: found by zipimport through package __path__
+    import snappkg.other
+    assert snappkg.other.y == 1
+
+
+def test_snapshot_disabled(snapshot_app, monkeypatch):
+    monkeypatch.setenv('EXXO_SNAPSHOT', '0')
+    with mock.patch.object(sys, 'executable', str(snapshot_app)):
+        importer = ModuleImporter()
+        assert importer.load_snapshot() is None
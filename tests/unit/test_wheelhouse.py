@@ -0,0 +1,83 @@
+import subprocess
+import pytest
+
+from exxo.wheelhouse import Wheelhouse, parse_lock, lock_digest
+
+
+def test_parse_lock(tmpdir):
+    lock = tmpdir.join('requirements.lock')
+    lock.write("""# generated
+Flask==0.10.1 \\
+    --hash=sha256:bbb \\
+    --hash=sha256:aaa
+zope.interface==4.1.3  # via gevent
+-i https://pypi.org/simple
+
+""")
+    reqs = parse_lock(str(lock))
+    assert reqs == {
+        'flask': 'Flask==0.10.1 --hash=sha256:aaa --hash=sha256:bbb',
+        'zope-interface': 'zope.interface==4.1.3',
+    }
+    lock.write('zope.interface==4.1.3\nFlask==0.10.1 --hash=sha256:aaa --hash=sha256:bbb\n')
+    assert lock_digest(parse_lock(str(lock))) == lock_digest(reqs)
+
+
+def test_parse_lock_keeps_specifiers_and_markers(tmpdir):
+    lock = tmpdir.join('requirements.lock')
+    lock.write("""foo==1.0 ; python_version < "3.8" \\
+    --hash=sha256:bbb --hash=sha256:aaa
+bar   ==  2.0
+""")
+    assert parse_lock(str(lock)) == {
+        'foo': 'foo==1.0 ; python_version < "3.8" --hash=sha256:aaa --hash=sha256:bbb',
+        'bar': 'bar == 2.0',
+    }
+
+
+@pytest.fixture
+def pip_calls(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    site_packages = tmpdir.join('env', 'site-packages').ensure(dir=True)
+    calls = []
+
+    def fake_pip(cmd):
+        calls.append(cmd)
+        if cmd[1] == 'uninstall':
+            for name in cmd[3:]:
+                site_packages.join(name).remove(ignore_errors=True)
+        elif cmd[-1].endswith('/'):
+            site_packages.join('proj').write('')
+        else:
+            site_packages.join('flask').write('')
+        return 0
+    monkeypatch.setattr(subprocess, 'call', fake_pip)
+    monkeypatch.setattr(subprocess, 'check_call', fake_pip)
+    tmpdir.join('requirements.lock').write('Flask==0.10.1\n')
+    return calls
+
+
+def wheelhouse(tmpdir, pyrun):
+    tmpdir.join(pyrun).write(pyrun)
+    return Wheelhouse(str(tmpdir.join('requirements.lock')), str(tmpdir), str(tmpdir.join('env')),
+                      str(tmpdir.join('env', 'site-packages')), str(tmpdir.join(pyrun)))
+
+
+def test_snapshot_holds_dependencies_of_one_pyrun(tmpdir, pip_calls):
+    # project from a previous build
+    tmpdir.join('env', 'site-packages', 'proj').write('')
+    wh = wheelhouse(tmpdir, 'pyrun3.5')
+    wh.install('proj', 'src/')
+    assert pip_calls[0] == ['pip', 'uninstall', '-y', 'proj']
+    assert pip_calls[-1][-1] == 'src/'
+    site_packages = tmpdir.join('env', 'site-packages')
+    assert sorted(p.basename for p in site_packages.listdir()) == ['flask', 'proj']
+    digest = lock_digest(parse_lock(str(tmpdir.join('requirements.lock'))))
+    snapshot = wh.snapshot_dir(digest)
+    assert [p.name for p in snapshot.iterdir()] == ['flask']
+    # same lock, different interpreter
+    tmpdir.join('env', 'exxo-lock.json').remove()
+    wh = wheelhouse(tmpdir, 'pyrun2.7')
+    assert wh.snapshot_dir(digest) != snapshot
+    wh.install('proj', 'src/')
+    assert not wh.stats['cached']